@@ -0,0 +1,127 @@
+import unittest
+import io
+import os
+import tarfile
+import tempfile
+import zipfile
+from pathlib import Path
+from unittest import mock
+from wf import configurations
+from wf.configurations import extract_tar_gz, extract_tar_xz, extract_zip, fetch_prebuilt_reference, GenomeType, \
+    Chemistry, Verbosity, ClusteringSensitivity
+
+
+class SafeTarExtractionTest(unittest.TestCase):
+    # Local archives only, so no Latch fixtures are needed.
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        self.dest = os.path.join(self.tmp, 'dest')
+        os.makedirs(self.dest)
+
+    def write_archive(self, name, mode, member_name):
+        archive_p = os.path.join(self.tmp, name)
+        data = b'malicious'
+        with tarfile.open(archive_p, mode) as tf:
+            member = tarfile.TarInfo(member_name)
+            member.size = len(data)
+            tf.addfile(member, io.BytesIO(data))
+        return archive_p
+
+    def assert_contained(self, extract, archive_p, must_raise=True):
+        # Exercise both the "data" filter and the manual check used when tarfile lacks it.
+        for has_data_filter in (True, False):
+            if has_data_filter and not hasattr(tarfile, 'data_filter'):
+                continue
+            with self.subTest(has_data_filter=has_data_filter), \
+                    mock.patch.object(configurations, '_TARFILE_HAS_DATA_FILTER', has_data_filter):
+                try:
+                    extract(archive_p, dest=self.dest)
+                except tarfile.TarError:
+                    pass
+                else:
+                    # The "data" filter strips a leading "/" (like tar) instead of failing.
+                    self.assertFalse(must_raise, 'Extraction outside of dest was not refused.')
+                self.assertFalse(os.path.exists(os.path.join(self.tmp, 'evil.txt')))
+
+    def test_tar_gz_rejects_parent_dir_member(self):
+        archive_p = self.write_archive('ref.tar.gz', 'w:gz', '../evil.txt')
+        # Force the tarfile fallback (no rapidgzip, no pigz).
+        with mock.patch.object(configurations, 'rapidgzip', None), \
+                mock.patch.object(configurations.shutil, 'which', return_value=None):
+            self.assert_contained(extract_tar_gz, archive_p)
+
+    def test_tar_gz_contains_absolute_member(self):
+        archive_p = self.write_archive('ref.tar.gz', 'w:gz', os.path.join(self.tmp, 'evil.txt'))
+        with mock.patch.object(configurations, 'rapidgzip', None), \
+                mock.patch.object(configurations.shutil, 'which', return_value=None):
+            self.assert_contained(extract_tar_gz, archive_p, must_raise=False)
+
+    def test_tar_xz_rejects_parent_dir_member(self):
+        archive_p = self.write_archive('ref.tar.xz', 'w:xz', '../evil.txt')
+        with mock.patch.object(configurations.shutil, 'which', return_value=None):
+            self.assert_contained(extract_tar_xz, archive_p)
+
+    def test_tar_gz_extracts_regular_member(self):
+        archive_p = self.write_archive('ref.tar.gz', 'w:gz', 'STAR_index/Genome')
+        with mock.patch.object(configurations, 'rapidgzip', None), \
+                mock.patch.object(configurations.shutil, 'which', return_value=None):
+            extract_tar_gz(archive_p, dest=self.dest)
+        self.assertTrue(os.path.isfile(os.path.join(self.dest, 'STAR_index', 'Genome')))
+
+    def write_zip(self, member_name):
+        archive_p = os.path.join(self.tmp, 'ref.zip')
+        with zipfile.ZipFile(archive_p, 'w') as zf:
+            zf.writestr(member_name, b'malicious')
+        return archive_p
+
+    def test_zip_rejects_parent_dir_member(self):
+        archive_p = self.write_zip('../evil/evil.txt')
+        with self.assertRaises(zipfile.BadZipFile):
+            extract_zip(archive_p, dest=self.dest)
+        self.assertFalse(os.path.exists(os.path.join(self.tmp, 'evil')))
+
+    def test_zip_rejects_absolute_dir_member(self):
+        archive_p = self.write_zip(os.path.join(self.tmp, 'evil') + '/')
+        with self.assertRaises(zipfile.BadZipFile):
+            extract_zip(archive_p, dest=self.dest)
+        self.assertFalse(os.path.exists(os.path.join(self.tmp, 'evil')))
+
+    def test_zip_extracts_regular_member(self):
+        archive_p = self.write_zip('STAR_index/Genome')
+        extract_zip(archive_p, dest=self.dest)
+        self.assertTrue(os.path.isfile(os.path.join(self.dest, 'STAR_index', 'Genome')))
+
+
+class FetchPrebuiltReferenceTest(unittest.TestCase):
+
+    def test_missing_unpacked_directory_raises(self):
+        with tempfile.TemporaryDirectory() as tmp, \
+                mock.patch.object(configurations, 'download_prebuilt_reference') as download:
+            with self.assertRaises(ValueError):
+                fetch_prebuilt_reference('s3://latch-public/ref.tar.gz', Path(tmp) / 'ref')
+        download.assert_called_once_with('s3://latch-public/ref.tar.gz')
+
+    def test_unpacked_directory_is_accepted(self):
+        with tempfile.TemporaryDirectory() as tmp, \
+                mock.patch.object(configurations, 'download_prebuilt_reference'):
+            fetch_prebuilt_reference('s3://latch-public/ref.tar.gz', Path(tmp))
+
+
+class ParameterEnumTypeTest(unittest.TestCase):
+
+    def test_parameter_enums_serialize_as_enums(self):
+        # A str-mixin enum is matched by the str transformer first, losing the UI choices and arriving as a bare str.
+        from flytekit.core.type_engine import TypeEngine
+
+        for enum_type in (GenomeType, Chemistry, Verbosity, ClusteringSensitivity):
+            with self.subTest(enum_type=enum_type.__name__):
+                literal_type = TypeEngine.to_literal_type(enum_type)
+                self.assertIsNotNone(literal_type.enum_type)
+                self.assertEqual(list(literal_type.enum_type.values), [member.value for member in enum_type])
+
+
+if __name__ == '__main__':
+    unittest.main()
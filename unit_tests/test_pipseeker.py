@@ -18,112 +18,157 @@ Usage:
 
 import unittest
 import os
+import posixpath
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 from wf.configurations import GenomeType, Chemistry, PIPseekerMode
 from wf import pipseeker_wf
-from unit_tests.test_utils import UnitTest
-import glob
+from wf.pipseeker import upload_partial_output
+from unit_tests.test_utils import UnitTest, latest_log_file, list_dir_names
 
 
 class PIPseekerTest(UnitTest):
-
-    def test_snt_mode(self):
-        self.star_index_zipped_path_local = os.path.join(self.TEST_DATA, 'STAR_test_index.zip')
-        self.local_snt_dir_path = os.path.join(self.TEST_DATA, 'snt_tests')
+    output_dir = os.path.join('pipseeker_out')
+    logs_dir = os.path.join(output_dir, 'logs')
+    cell_calling_dir = os.path.join(output_dir, 'cell_calling')
+    clustering_dir = os.path.join(output_dir, 'clustering')
+    snt_cell_calling_dir = os.path.join(output_dir, 'SNT', 'cell_calling')
+    snt_clustering_dir = os.path.join(output_dir, 'SNT', 'clustering')
+    report_file = os.path.join(output_dir, 'report.html')
+
+    # Log markers checked for each run.
+    full_mode_log_included = ('Saving molecule info file', 'Running clustering', 'sensitivity_3',
+                              'Creating summary report', 'Merging SNT data')
+    full_mode_log_excluded = ('Merging HTO data',)
+    cells_mode_log_included = ('Running clustering', 'force_99', 'Creating summary report')
+    cells_mode_log_excluded = ('Merging SNT data', 'Saving molecule info file')
+
+    # Expected cell calling and clustering outputs for each run.
+    full_mode_sensitivities = frozenset(['sensitivity_1', 'sensitivity_2', 'sensitivity_3'])
+    cells_mode_sensitivities = frozenset(['force_99', 'sensitivity_1', 'sensitivity_2', 'sensitivity_3'])
+
+    @classmethod
+    def setUpClass(cls):
+        # Run the (expensive) workflow once per class; the tests below only check the recorded outputs.
+        super().setUpClass()
+        star_index_zipped_path_local = os.path.join(cls.TEST_DATA, 'STAR_test_index.zip')
+        local_snt_dir_path = os.path.join(cls.TEST_DATA, 'snt_tests')
 
         # Test snt mode LOCAL
         pipseeker_wf(pipseeker_mode=PIPseekerMode.full.value, output_directory='.',
-                     fastq_directory=os.path.join(self.local_snt_dir_path, 'fastqs'), chemistry=Chemistry.v4,
+                     fastq_directory=os.path.join(local_snt_dir_path, 'fastqs'), chemistry=Chemistry.v4,
                      genome_source='custom_prebuilt_genome', prebuilt_genome=GenomeType.human,
-                     custom_prebuilt_genome=None, custom_prebuilt_genome_zipped=self.star_index_zipped_path_local,
+                     custom_prebuilt_genome=None, custom_prebuilt_genome_zipped=star_index_zipped_path_local,
                      min_sensitivity=1, max_sensitivity=3, clustering_percent_genes=80, diff_exp_genes=50,
-                     snt_fastq=os.path.join(self.local_snt_dir_path, 'snt_fastqs'),
-                     snt_tags=os.path.join(self.local_snt_dir_path, 'tags_1_withExtra.csv'), snt_position=3,
+                     snt_fastq=os.path.join(local_snt_dir_path, 'snt_fastqs'),
+                     snt_tags=os.path.join(local_snt_dir_path, 'tags_1_withExtra.csv'), snt_position=3,
                      custom_genome_reference_fasta=None, custom_genome_reference_gtf=None)
-
-        # # Verify that the RNA analysis ran to completion, and that cell calling and clustering outputs
-        # #   are specific to the indicated sensitivites.
-
-        self.output_dir = os.path.join('pipseeker_out')
-        expected_sensitivities = ['sensitivity_1', 'sensitivity_2', 'sensitivity_3']
-
-        self.logs_dir = os.path.join(self.output_dir, 'logs')
-        self.verify_log_file(included=['Saving molecule info file', 'Running clustering', 'sensitivity_3',
-                                       'Creating summary report', 'Merging SNT data'],
-                             excluded=['Merging HTO data'], msg='Failed')
-
-        self.verify_dir_ls(os.path.join(self.output_dir, 'cell_calling'), expected_sensitivities, msg='Failed')
-        self.verify_dir_ls(os.path.join(self.output_dir, 'clustering'), expected_sensitivities, msg='Failed')
-        self.assertFalse(os.path.isdir(os.path.join(self.output_dir, 'SNT', 'cell_calling')), 'Failed')
-        self.assertFalse(os.path.isdir(os.path.join(self.output_dir, 'SNT', 'clustering')), 'Failed')
-        self.assertTrue(os.path.isfile(os.path.join(self.output_dir,'report.html')), 'Failed')
-
+        # The cells mode run below updates the same output directory, so record the full mode outputs first.
+        cls.full_mode_outputs = cls.record_outputs()
 
         # CELLS MODE
         #  Run it on the previous full run.
-        pipseeker_wf(pipseeker_mode=PIPseekerMode.cells.value, previous=self.output_dir, force_cells=99,
+        pipseeker_wf(pipseeker_mode=PIPseekerMode.cells.value, previous=cls.output_dir, force_cells=99,
                      # Add extra params required for workflow that aren't required by cells mode...
                      genome_source='custom_prebuilt_genome', prebuilt_genome=GenomeType.human,
-                     custom_prebuilt_genome=None, custom_prebuilt_genome_zipped=self.star_index_zipped_path_local,
+                     custom_prebuilt_genome=None, custom_prebuilt_genome_zipped=star_index_zipped_path_local,
                      clustering_percent_genes=80, diff_exp_genes=50,
-                     # snt_fastq=os.path.join(self.local_snt_dir_path, 'snt_fastqs'),
-                     # snt_tags=os.path.join(self.local_snt_dir_path, 'tags_1_withExtra.csv'), snt_position=3,
+                     # snt_fastq=os.path.join(local_snt_dir_path, 'snt_fastqs'),
+                     # snt_tags=os.path.join(local_snt_dir_path, 'tags_1_withExtra.csv'), snt_position=3,
                      custom_genome_reference_fasta=None, custom_genome_reference_gtf=None)
-
-        expected_sensitivities = ['force_99', 'sensitivity_1', 'sensitivity_2', 'sensitivity_3']
-
-        self.logs_dir = os.path.join(self.output_dir, 'logs')
-        self.verify_log_file(included=['Running clustering', 'force_99', 'Creating summary report'],
-                             excluded=['Merging SNT data' 'Saving molecule info file'], msg='Failed')
-
-        self.verify_dir_ls(os.path.join(self.output_dir, 'cell_calling'), expected_sensitivities, msg='Failed')
-        self.verify_dir_ls(os.path.join(self.output_dir, 'clustering'), expected_sensitivities, msg='Failed')
-        self.assertFalse(os.path.isdir(os.path.join(self.output_dir, 'SNT', 'cell_calling')), 'Failed')
-        self.assertFalse(os.path.isdir(os.path.join(self.output_dir, 'SNT', 'clustering')), 'Failed')
-        self.assertTrue(os.path.isfile(os.path.join(self.output_dir, 'report.html')), 'Failed')
-
-
-    def get_latest_log_file(self, logs_dir=None):
-        if logs_dir is None:
-            log_files = glob.glob(os.path.join(self.logs_dir, 'pipseeker*.log'))
-        else:
-            log_files = glob.glob(os.path.join(logs_dir, 'pipseeker*.log'))
-        return sorted(log_files)[-1]
-
-    def verify_log_file(self, logs_dir=None, **kwargs):
-        log_file = self.get_latest_log_file(logs_dir=logs_dir)
-        self.verify_file_content(log_file, **kwargs)
-
-    def verify_file_content(self, filename, included=[], excluded=[], msg=None, exact=None, case_sensitive=True):
-        # A helper to verify the content of any text file.
-        # included and excluded can be a string or a list of strings.
-
-        if type(included) is str:
-            included = [included]
-        if type(excluded) is str:
-            excluded = [excluded]
-
-        with open(filename) as fid:
-            text = fid.read()
-
-        if not case_sensitive:
-            text = text.lower()
-
-        for included_str in included:
-            if not case_sensitive:
-                included_str = included_str.lower()
-            self.assertTrue(included_str in text,
-                            msg='String "%s" not found in file %s, %s' % (included_str, filename, msg))
-        for excluded_str in excluded:
-            if not case_sensitive:
-                excluded_str = excluded_str.lower()
-            self.assertFalse(excluded_str in text,
-                             msg='String "%s" unexpectedly found in file %s, %s' % (excluded_str, filename, msg))
-        if exact is not None:
-            self.assertEqual(text, exact, msg=msg)
-
-    def verify_dir_ls(self, dir, expected, msg=None):
-        # Verify directory contents against a list of expected files (names only, not full path).
-        self.assertEqual(sorted(os.listdir(dir)), sorted(expected), msg=msg)
+        cls.cells_mode_outputs = cls.record_outputs()
+
+    @classmethod
+    def record_outputs(cls):
+        # Snapshot the outputs of the latest run.
+        #   The filesystem checks are independent, so run them concurrently to overlap slow (e.g. FUSE) stat calls.
+        checks = {
+            'log_file': (latest_log_file, cls.logs_dir),
+            'cell_calling': (list_dir_names, cls.cell_calling_dir),
+            'clustering': (list_dir_names, cls.clustering_dir),
+            'snt_cell_calling_exists': (os.path.isdir, cls.snt_cell_calling_dir),
+            'snt_clustering_exists': (os.path.isdir, cls.snt_clustering_dir),
+            'report_exists': (os.path.isfile, cls.report_file),
+        }
+        with ThreadPoolExecutor(max_workers=len(checks)) as executor:
+            results = executor.map(lambda check: check[0](check[1]), checks.values())
+            return dict(zip(checks, results))
+
+    def test_log_markers(self):
+        # Verify that the RNA analysis ran to completion.
+        with self.subTest(mode='full'):
+            self.verify_log_file(log_file=self.full_mode_outputs['log_file'],
+                                 included=self.full_mode_log_included,
+                                 excluded=self.full_mode_log_excluded, msg='Failed')
+        with self.subTest(mode='cells'):
+            self.verify_log_file(log_file=self.cells_mode_outputs['log_file'],
+                                 included=self.cells_mode_log_included,
+                                 excluded=self.cells_mode_log_excluded, msg='Failed')
+
+    def test_cell_calling_dirs(self):
+        # Cell calling outputs are specific to the indicated sensitivities.
+        with self.subTest(mode='full'):
+            self.assertEqual(self.full_mode_outputs['cell_calling'],
+                             self.full_mode_sensitivities, msg='Failed')
+        with self.subTest(mode='cells'):
+            self.assertEqual(self.cells_mode_outputs['cell_calling'],
+                             self.cells_mode_sensitivities, msg='Failed')
+
+    def test_clustering_dirs(self):
+        # Clustering outputs are specific to the indicated sensitivities.
+        with self.subTest(mode='full'):
+            self.assertEqual(self.full_mode_outputs['clustering'],
+                             self.full_mode_sensitivities, msg='Failed')
+        with self.subTest(mode='cells'):
+            self.assertEqual(self.cells_mode_outputs['clustering'],
+                             self.cells_mode_sensitivities, msg='Failed')
+
+    def test_snt_dirs(self):
+        for mode, outputs in [('full', self.full_mode_outputs), ('cells', self.cells_mode_outputs)]:
+            with self.subTest(mode=mode):
+                self.assertFalse(outputs['snt_cell_calling_exists'], 'Failed')
+                self.assertFalse(outputs['snt_clustering_exists'], 'Failed')
+
+    def test_report_exists(self):
+        for mode, outputs in [('full', self.full_mode_outputs), ('cells', self.cells_mode_outputs)]:
+            with self.subTest(mode=mode):
+                self.assertTrue(outputs['report_exists'], 'Failed')
+
+
+class UploadPartialOutputTest(unittest.TestCase):
+
+    @staticmethod
+    def uploaded_remote_path(destination_directory, src):
+        # Where Latch's upload puts a directory uploaded into an existing destination:
+        #   its contents when src ends in "/", otherwise a subdirectory named after src.
+        if src.endswith('/'):
+            return destination_directory
+        return posixpath.join(destination_directory, os.path.basename(src))
+
+    def test_partial_output_matches_successful_output_path(self):
+        destination_directory = 'latch://26230.account/PIPseeker_Output/run_1'
+        with tempfile.TemporaryDirectory() as tmp, mock.patch('wf.pipseeker.LPath') as lpath:
+            local_output_dir = os.path.join(tmp, 'pipseeker_out')
+            os.makedirs(os.path.join(local_output_dir, 'logs'))
+
+            upload_partial_output(local_output_dir, destination_directory)
+
+        lpath.assert_called_once_with(destination_directory)
+        (src,), _ = lpath.return_value.upload_from.call_args
+        # A successful run returns LatchOutputDir(local_output_dir, remote_path=destination_directory).
+        self.assertEqual(self.uploaded_remote_path(destination_directory, str(src)), destination_directory)
+        self.assertEqual(os.path.normpath(src), local_output_dir)
+
+    def test_upload_failure_is_only_logged(self):
+        with tempfile.TemporaryDirectory() as tmp, mock.patch('wf.pipseeker.LPath') as lpath:
+            lpath.return_value.upload_from.side_effect = RuntimeError('upload failed')
+            upload_partial_output(tmp, 'latch://26230.account/PIPseeker_Output')
+
+    def test_missing_output_dir_is_not_uploaded(self):
+        with mock.patch('wf.pipseeker.LPath') as lpath:
+            upload_partial_output('/nonexistent/pipseeker_out', 'latch://26230.account/PIPseeker_Output')
+        lpath.assert_not_called()
 
 
 if __name__ == '__main__':
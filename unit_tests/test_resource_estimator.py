@@ -1,88 +1,86 @@
 import unittest
 import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 from latch.types import LatchDir, LatchFile
-from wf.resource_estimator import get_num_threads, get_memory_requirement_gb, get_disk_requirement_gb, mapping_ref_size_estimator
+from wf import resource_estimator
+from wf.resource_estimator import get_num_threads, get_memory_requirement_gb, get_disk_requirement_gb, mapping_ref_size_estimator, \
+    star_ram_estimator, clear_cache, get_fastqs_size_bytes
 from wf.configurations import GenomeType, PIPseekerMode
-from unit_tests.test_utils import UnitTest
+from unit_tests.test_utils import UnitTest, cached_latch_dir, ensure_latch_asset
 
 
 class ResourceEstimatorTest(UnitTest):
-    def setUp(self):
-        super().setUp()
-        # Check whether the fastqs exist in latch account.
-        self.latch_fastq_dir_path = 'latch://26230.account/TEST_fastqs_10mb_Pbmc_v4'
-        self.fastqs_local_path = os.path.join(self.TEST_DATA, 'fastqs')
+    _fixtures_ready = False
 
-        # Prep test fastqs on the Latch cloud.
-        try:
-            LatchDir(self.latch_fastq_dir_path)
-            print(f"Successfully detected test FASTQs on Latch at {self.latch_fastq_dir_path}")
-        except:
-            # Upload files to latch via bash.
-            print(f'Uploading test fastqs to Latch at {self.latch_fastq_dir_path}')
-            os.system(f'latch cp {self.fastqs_local_path} {self.latch_fastq_dir_path}')
-            if not os.path.exists(LatchDir(self.latch_fastq_dir_path)):
-                raise FileNotFoundError('Failed to upload or identify fastqs to Latch.')
-
-        # Prep STAR index on the Latch cloud.
-        # Zipped STAR index
-        self.star_index_zipped_path_local = os.path.join(self.TEST_DATA, 'STAR_test_index.zip')
-        self.latch_star_zipped_path = 'latch://26230.account/STAR_test_index.zip'
+    @classmethod
+    def setUpClass(cls):
+        # Probe (and if needed upload) the Latch test assets once per class rather than before every test.
+        super().setUpClass()
+        if cls._fixtures_ready:
+            return
+        cls.latch_fastq_dir_path = 'latch://26230.account/TEST_fastqs_10mb_Pbmc_v4'
+        cls.fastqs_local_path = os.path.join(cls.TEST_DATA, 'fastqs')
 
-        try:
-            LatchFile(self.latch_star_zipped_path)
-            print(f"Successfully detected test STAR index on Latch at {self.latch_star_zipped_path}")
-        except:
-            print(f'Uploading STAR index to Latch at {self.latch_star_zipped_path}')
-            os.system(f'latch cp {self.star_index_zipped_path_local} {self.latch_star_zipped_path}')
-            if not os.path.exists(LatchFile(self.latch_star_zipped_path)):
-                raise FileNotFoundError('Failed to upload or identify STAR index to Latch.')
+        # Zipped STAR index
+        cls.star_index_zipped_path_local = os.path.join(cls.TEST_DATA, 'STAR_test_index.zip')
+        cls.latch_star_zipped_path = 'latch://26230.account/STAR_test_index.zip'
 
         # Unzipped STAR index
-        self.star_index_dir_path_local = os.path.join(self.TEST_DATA, 'STAR_test_index')
-        self.latch_star_unzipped_dir_path = 'latch://26230.account/STAR_test_index'
-
-        try:
-            LatchDir(self.latch_star_unzipped_dir_path)
-            print(f"Successfully detected test STAR index on Latch at {self.latch_star_unzipped_dir_path}")
-        except:
-            #  First, unzip the STAR index locally.
-            print(f'Unzipping STAR index to {self.star_index_dir_path_local}')
-            os.system(f'unzip {self.star_index_zipped_path_local} -d {self.star_index_dir_path_local}')
-            if not os.path.exists(self.star_index_dir_path_local):
+        cls.star_index_dir_path_local = os.path.join(cls.TEST_DATA, 'STAR_test_index')
+        cls.latch_star_unzipped_dir_path = 'latch://26230.account/STAR_test_index'
+
+        def unzip_star_index():
+            #  First, unzip the STAR index locally (unless a previous run already did).
+            if os.path.isdir(cls.star_index_dir_path_local):
+                return
+            print(f'Unzipping STAR index to {cls.star_index_dir_path_local}')
+            with zipfile.ZipFile(cls.star_index_zipped_path_local) as zf:
+                zf.extractall(cls.star_index_dir_path_local)
+            if not os.path.exists(cls.star_index_dir_path_local):
                 raise FileNotFoundError('Failed to unzip STAR index.')
-            print(f'Uploading STAR index to Latch at {self.latch_star_unzipped_dir_path}')
-            os.system(f'latch cp {self.star_index_dir_path_local} {self.latch_star_unzipped_dir_path}')
-            if not os.path.exists(LatchDir(self.latch_star_unzipped_dir_path)):
-                raise FileNotFoundError('Failed to upload or identify STAR index to Latch.')
+
+        # Prep test fastqs and STAR indices on the Latch cloud.
+        #   The assets are independent, so probe/upload them concurrently.
+        asset_specs = [
+            dict(local_path=cls.fastqs_local_path, remote_path=cls.latch_fastq_dir_path, is_dir=True),
+            dict(local_path=cls.star_index_zipped_path_local, remote_path=cls.latch_star_zipped_path, is_dir=False),
+            dict(local_path=cls.star_index_dir_path_local, remote_path=cls.latch_star_unzipped_dir_path, is_dir=True,
+                 prepare=unzip_star_index),
+        ]
+        with ThreadPoolExecutor(max_workers=len(asset_specs)) as executor:
+            cls.latch_fastq_dir, cls.latch_star_zipped, cls.latch_star_unzipped = executor.map(
+                lambda spec: ensure_latch_asset(**spec), asset_specs)
+        cls._fixtures_ready = True
 
     def test_get_num_threads(self):
         # Dir has very tiny fastq set so should have the 4-thread minimum.
         # Full mode.
-        self.assertEqual(get_num_threads(fastq_directory=LatchDir(self.latch_fastq_dir_path),
+        self.assertEqual(get_num_threads(fastq_directory=self.latch_fastq_dir,
                                          pipseeker_mode=PIPseekerMode.full.value), 8)
 
         # Check the override function.
-        self.assertEqual(get_num_threads(fastq_directory=LatchDir(self.latch_fastq_dir_path),
+        self.assertEqual(get_num_threads(fastq_directory=self.latch_fastq_dir,
                                          pipseeker_mode=PIPseekerMode.full.value,
                                          override_cpu=7), 7)
 
         #   Max threads is 64 so should default to that.
-        self.assertEqual(get_num_threads(fastq_directory=LatchDir(self.latch_fastq_dir_path),
+        self.assertEqual(get_num_threads(fastq_directory=self.latch_fastq_dir,
                                          pipseeker_mode=PIPseekerMode.full.value,
                                          override_cpu=1000), 64)
 
         # Buildmapref mode uses 64 threads by default.
-        self.assertEqual(get_num_threads(fastq_directory=LatchDir(self.latch_fastq_dir_path),
+        self.assertEqual(get_num_threads(fastq_directory=self.latch_fastq_dir,
                                          pipseeker_mode=PIPseekerMode.buildmapref.value), 64)
 
         # Custom threads, set lower.
-        self.assertEqual(get_num_threads(fastq_directory=LatchDir(self.latch_fastq_dir_path),
+        self.assertEqual(get_num_threads(fastq_directory=self.latch_fastq_dir,
                                          pipseeker_mode=PIPseekerMode.buildmapref.value,
                                          override_cpu=1), 1)
 
         # Custom threads, set higher.
-        self.assertEqual(get_num_threads(fastq_directory=LatchDir(self.latch_fastq_dir_path),
+        self.assertEqual(get_num_threads(fastq_directory=self.latch_fastq_dir,
                                          pipseeker_mode=PIPseekerMode.buildmapref.value,
                                          override_cpu=1000), 64)
 
@@ -91,27 +89,40 @@ class ResourceEstimatorTest(UnitTest):
         try:
             # The following test requires having an existing sample sitting on the latch platform.
             previous_dir = 'latch://26230.account/3.2.0_small_test'
-            self.assertEqual(get_num_threads(previous=LatchDir(previous_dir),
+            self.assertEqual(get_num_threads(previous=cached_latch_dir(previous_dir),
                                              pipseeker_mode=PIPseekerMode.cells.value), 8)
         except FileNotFoundError as e:
             print("Skipping test requiring existing sample on Latch, since dir not found: ", e)
 
 
     def test_get_mapping_ref_size(self):
+        # Start from cold caches so the first estimates below really size the references.
+        clear_cache()
 
         # Zipped STAR index.
         ref_size_bytes = mapping_ref_size_estimator(genome_source='custom_prebuilt_genome',
                                                 prebuilt_genome=None,
                                                 custom_prebuilt_genome=None,
-                                                custom_prebuilt_genome_zipped=LatchFile(self.latch_star_zipped_path))
-        self.assertEqual(ref_size_bytes, 1965038.75)  # 0.00183 GB
+                                                custom_prebuilt_genome_zipped=self.latch_star_zipped)
+        self.assertAlmostEqual(ref_size_bytes, 5030499.2)  # 0.00468 GB, 3.2x the zip
 
-        # Unzipped STAR index.
+        # Unzipped STAR index, from the local fixture so the expected size is measured from files in this repo.
+        #   Counts every file, including the nested logs/ directory.
         ref_size_bytes = mapping_ref_size_estimator(genome_source='custom_prebuilt_genome',
                                                 prebuilt_genome=None,
-                                                custom_prebuilt_genome=LatchDir(self.latch_star_unzipped_dir_path),
+                                                custom_prebuilt_genome=self.star_index_dir_path_local,
                                                 custom_prebuilt_genome_zipped=None)
-        self.assertEqual(ref_size_bytes, 2169065)  # 0.00202 GB
+        self.assertEqual(ref_size_bytes, 855341)  # 0.00080 GB
+
+        # Repeated estimates for the same reference are served from the cache, without sizing it again.
+        with mock.patch('wf.resource_estimator._estimate_mapping_ref_size',
+                        wraps=resource_estimator._estimate_mapping_ref_size) as estimate:
+            ref_size_bytes = mapping_ref_size_estimator(genome_source='custom_prebuilt_genome',
+                                                        prebuilt_genome=None,
+                                                        custom_prebuilt_genome=self.star_index_dir_path_local,
+                                                        custom_prebuilt_genome_zipped=None)
+        estimate.assert_not_called()
+        self.assertEqual(ref_size_bytes, 855341)
 
         # For the pre-built references hosted on s3.
         #   Human ref is 9.61 GB.
@@ -124,25 +135,24 @@ class ResourceEstimatorTest(UnitTest):
 
     def test_get_memory_requirement_gb(self):
         # Zipped STAR index.
-        required_ram = get_memory_requirement_gb(fastq_directory=LatchDir(self.latch_fastq_dir_path),
+        required_ram = get_memory_requirement_gb(fastq_directory=self.latch_fastq_dir,
                                                  pipseeker_mode=PIPseekerMode.full.value,
                                                  genome_source='custom_prebuilt_genome',
                                                  prebuilt_genome=None,
                                                  custom_prebuilt_genome=None,
-                                                 custom_prebuilt_genome_zipped=LatchFile(self.latch_star_zipped_path),
+                                                 custom_prebuilt_genome_zipped=self.latch_star_zipped,
                                                  downsample_to=None,
                                                  input_reads=None,
                                                  sorted_bam=False)
         self.assertEqual(49, required_ram)
 
         # Unzipped STAR index.
-        required_ram = get_memory_requirement_gb(fastq_directory=LatchDir(self.latch_fastq_dir_path),
+        required_ram = get_memory_requirement_gb(fastq_directory=self.latch_fastq_dir,
                                                  pipseeker_mode=PIPseekerMode.full.value,
                                                  genome_source='custom_prebuilt_genome',
                                                  prebuilt_genome=None,
                                                  custom_prebuilt_genome=None,
-                                                 custom_prebuilt_genome_zipped=LatchDir(
-                                                     self.latch_star_unzipped_dir_path),
+                                                 custom_prebuilt_genome_zipped=self.latch_star_unzipped,
                                                  downsample_to=None,
                                                  input_reads=None,
                                                  sorted_bam=False)
@@ -150,7 +160,7 @@ class ResourceEstimatorTest(UnitTest):
 
         # For the pre-built references hosted on s3.
         #   Human ref is 9.61 GB.
-        required_ram = get_memory_requirement_gb(fastq_directory=LatchDir(self.latch_fastq_dir_path),
+        required_ram = get_memory_requirement_gb(fastq_directory=self.latch_fastq_dir,
                                                  pipseeker_mode=PIPseekerMode.full.value,
                                                snt_fastq=None,
                                                hto_fastq=None,
@@ -164,7 +174,7 @@ class ResourceEstimatorTest(UnitTest):
         self.assertEqual(49, required_ram)
 
         # Test the override function
-        required_ram = get_memory_requirement_gb(fastq_directory=LatchDir(self.latch_fastq_dir_path),
+        required_ram = get_memory_requirement_gb(fastq_directory=self.latch_fastq_dir,
                                                  pipseeker_mode=PIPseekerMode.full.value,
                                                  snt_fastq=None,
                                                  hto_fastq=None,
@@ -181,7 +191,7 @@ class ResourceEstimatorTest(UnitTest):
         try:
             # The following test requires having an existing sample sitting on the latch platform.
             previous_dir = 'latch://26230.account/3.2.0_small_test'
-            required_ram = get_memory_requirement_gb(previous=LatchDir(previous_dir),
+            required_ram = get_memory_requirement_gb(previous=cached_latch_dir(previous_dir),
                                                         pipseeker_mode=PIPseekerMode.cells.value,
                                                         fastq_directory=None,
                                                         snt_fastq=None,
@@ -200,7 +210,7 @@ class ResourceEstimatorTest(UnitTest):
 
     def test_disk_requirement_gb(self):
         # On s3 (human genome is 9.61 GB).
-        required_disk = get_disk_requirement_gb(fastq_directory=LatchDir(self.latch_fastq_dir_path),
+        required_disk = get_disk_requirement_gb(fastq_directory=self.latch_fastq_dir,
                                                pipseeker_mode=PIPseekerMode.full.value,
                                                snt_fastq=None,
                                                hto_fastq=None,
@@ -215,12 +225,12 @@ class ResourceEstimatorTest(UnitTest):
 
         # Zipped STAR index.
         #   Will use 2GB for the zipped index, since STAR index is only 0.002 GB and rounds to 0.
-        required_disk = get_disk_requirement_gb(fastq_directory=LatchDir(self.latch_fastq_dir_path),
+        required_disk = get_disk_requirement_gb(fastq_directory=self.latch_fastq_dir,
                                                 pipseeker_mode=PIPseekerMode.full.value,
                                                 genome_source='custom_prebuilt_genome',
                                                 prebuilt_genome=None,
                                                 custom_prebuilt_genome=None,
-                                                custom_prebuilt_genome_zipped=LatchFile(self.latch_star_zipped_path),
+                                                custom_prebuilt_genome_zipped=self.latch_star_zipped,
                                                 downsample_to=None,
                                                 input_reads=None,
                                                 sorted_bam=False)
@@ -228,13 +238,12 @@ class ResourceEstimatorTest(UnitTest):
 
         # Unzipped STAR index.
         #   Again, uses 2GB because of small unzipped index size.
-        required_disk = get_disk_requirement_gb(fastq_directory=LatchDir(self.latch_fastq_dir_path),
+        required_disk = get_disk_requirement_gb(fastq_directory=self.latch_fastq_dir,
                                                 pipseeker_mode=PIPseekerMode.full.value,
                                                 genome_source='custom_prebuilt_genome',
                                                 prebuilt_genome=None,
                                                 custom_prebuilt_genome=None,
-                                                custom_prebuilt_genome_zipped=LatchDir(
-                                                    self.latch_star_unzipped_dir_path),
+                                                custom_prebuilt_genome_zipped=self.latch_star_unzipped,
                                                 downsample_to=None,
                                                 input_reads=None,
                                                 sorted_bam=False)
@@ -246,8 +255,7 @@ class ResourceEstimatorTest(UnitTest):
                                                 genome_source='custom_prebuilt_genome',
                                                 prebuilt_genome=None,
                                                 custom_prebuilt_genome=None,
-                                                custom_prebuilt_genome_zipped=LatchDir(
-                                                    self.latch_star_unzipped_dir_path),
+                                                custom_prebuilt_genome_zipped=self.latch_star_unzipped,
                                                 downsample_to=None,
                                                 input_reads=None,
                                                 sorted_bam=False)
@@ -266,18 +274,113 @@ class ResourceEstimatorTest(UnitTest):
         self.assertEqual(required_disk, 4)
 
         # Test the override function
-        required_disk = get_disk_requirement_gb(fastq_directory=LatchDir(self.latch_fastq_dir_path),
+        required_disk = get_disk_requirement_gb(fastq_directory=self.latch_fastq_dir,
                                                 pipseeker_mode=PIPseekerMode.full.value,
                                                 genome_source='custom_prebuilt_genome',
                                                 prebuilt_genome=None,
                                                 custom_prebuilt_genome=None,
-                                                custom_prebuilt_genome_zipped=LatchDir(
-                                                    self.latch_star_unzipped_dir_path),
+                                                custom_prebuilt_genome_zipped=self.latch_star_unzipped,
                                                 downsample_to=None,
                                                 input_reads=None,
                                                 sorted_bam=False,
                                                 override_disk_gb=1000)
         self.assertAlmostEqual(required_disk, 1000, places=1)
 
+
+class StarRamEstimatorTest(unittest.TestCase):
+    # Pure arithmetic, so no Latch fixtures are needed.
+    def test_star_ram_per_thread(self):
+        kwargs = dict(star_index_size_bytes=0, baseline_ram_bytes=0, sorted_bam=False, safety_margin=1)
+        # The 0.55 GB constant and the 0.23 GB/thread term are both in GB.
+        self.assertAlmostEqual(star_ram_estimator(num_threads=0, **kwargs) / 1024 ** 3, 0.55)
+        for num_threads in (1, 8, 16):
+            growth = star_ram_estimator(num_threads=num_threads + 1, **kwargs) - \
+                     star_ram_estimator(num_threads=num_threads, **kwargs)
+            self.assertAlmostEqual(growth / 1024 ** 3, 0.23)
+
+
+class CellsModeEstimatorTest(unittest.TestCase):
+
+    def setUp(self):
+        clear_cache()
+
+    @staticmethod
+    def previous_dir_with_bam(bam_size_bytes):
+        # A previous run: small top-level files plus a large BAM nested in a subdirectory.
+        top_level_files = []
+        for size in (200 * 1024 ** 2, 50 * 1024 ** 2):
+            file = mock.MagicMock(spec=LatchFile)
+            file.size.return_value = size
+            top_level_files.append(file)
+        previous = mock.MagicMock(spec=LatchDir)
+        previous.remote_path = 'latch://26230.account/previous_run_with_bam'
+        previous.iterdir.return_value = top_level_files + [mock.MagicMock(spec=LatchDir)]
+        previous.size_recursive.return_value = 250 * 1024 ** 2 + bam_size_bytes
+        return previous
+
+    def test_cells_ram_ignores_nested_bam(self):
+        previous = self.previous_dir_with_bam(bam_size_bytes=40 * 1024 ** 3)
+        # Top-level files are 0.25 GB -> (0 + 1) * 3 + 10.
+        self.assertEqual(get_memory_requirement_gb(pipseeker_mode=PIPseekerMode.cells.value, previous=previous,
+                                                   genome_source=None, prebuilt_genome=None,
+                                                   custom_prebuilt_genome=None, custom_prebuilt_genome_zipped=None),
+                         13)
+
+    def test_cells_disk_counts_nested_bam(self):
+        previous = self.previous_dir_with_bam(bam_size_bytes=40 * 1024 ** 3)
+        # 40.25 GB * 2 safety margin, rounded up.
+        self.assertEqual(get_disk_requirement_gb(pipseeker_mode=PIPseekerMode.cells.value, previous=previous,
+                                                 genome_source=None, prebuilt_genome=None,
+                                                 custom_prebuilt_genome=None, custom_prebuilt_genome_zipped=None),
+                         81)
+
+
+class S3FastqSizeFallbackTest(unittest.TestCase):
+
+    def setUp(self):
+        clear_cache()
+
+    def test_unlistable_s3_dir_falls_back_to_latch_listing(self):
+        from botocore.exceptions import NoCredentialsError
+
+        fastq_files = []
+        for name, size in (('sample_R1.fastq.gz', 3 * 1024 ** 2), ('sample_R2.fastq.gz', 5 * 1024 ** 2)):
+            file = mock.MagicMock(spec=LatchFile)
+            file.path = name
+            file.size.return_value = size
+            fastq_files.append(file)
+        fastq_directory = mock.MagicMock(spec=LatchDir)
+        fastq_directory.remote_path = 's3://private-bucket/fastqs'
+        fastq_directory.iterdir.return_value = fastq_files
+
+        with mock.patch('boto3.client', side_effect=NoCredentialsError()):
+            fastqs_size_bytes = get_fastqs_size_bytes(fastq_directory=fastq_directory, downsample_factor=None)
+        self.assertEqual(fastqs_size_bytes, 8 * 1024 ** 2)
+        fastq_directory.iterdir.assert_called_once()
+
+
+class InputSizeEstimateTest(unittest.TestCase):
+
+    def setUp(self):
+        clear_cache()
+
+    def test_reads_based_estimate_without_fastq_directory(self):
+        kwargs = dict(pipseeker_mode=PIPseekerMode.full.value, fastq_directory=None, input_reads=50_000_000,
+                      estimate_size_from_reads=True, genome_source=None, prebuilt_genome=None,
+                      custom_prebuilt_genome=None, custom_prebuilt_genome_zipped=None)
+        # 50M reads * 200 bytes = 9.31 GB of fastqs -> 3.5x plus a 2x safety margin, rounded up.
+        self.assertEqual(get_disk_requirement_gb(**kwargs), 66)
+        # 9.31 GB of fastqs -> 48 threads; barcoding peaks at ~196 GB, plus the 10 GB Latch minimum.
+        self.assertEqual(get_num_threads(**kwargs), 48)
+        self.assertEqual(get_memory_requirement_gb(**kwargs), 207)
+
+    def test_input_bytes_skips_directory_listing(self):
+        fastq_directory = mock.MagicMock(spec=LatchDir)
+        fastq_directory.remote_path = 'latch://26230.account/large_fastqs'
+        self.assertEqual(get_num_threads(pipseeker_mode=PIPseekerMode.full.value, fastq_directory=fastq_directory,
+                                         input_bytes=20 * 1024 ** 3), 64)
+        fastq_directory.iterdir.assert_not_called()
+
+
 if __name__ == '__main__':
     unittest.main()
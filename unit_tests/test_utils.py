@@ -9,6 +9,176 @@ import warnings
 import multiprocessing
 import hashlib
 import gzip
+import subprocess
+import functools
+import contextlib
+import mmap
+import re
+import time
+import fcntl
+from latch.ldata.path import LPath
+from latch.ldata.type import LatchPathError
+from latch.types import LatchDir, LatchFile
+
+
+# Latch test assets already prepared in this process, keyed by remote path.
+#   Shared across test classes so each asset is probed/uploaded at most once per test run.
+_latch_assets = {}
+
+
+@functools.lru_cache(maxsize=None)
+def cached_latch_dir(remote_path):
+    # Each Latch URI is resolved once per process.
+    return LatchDir(remote_path)
+
+
+@functools.lru_cache(maxsize=None)
+def cached_latch_file(remote_path):
+    # Each Latch URI is resolved once per process.
+    return LatchFile(remote_path)
+
+
+# Cached Latch existence lookups: {remote_path: (exists, expiry time)}.
+_latch_path_exists_cache = {}
+
+
+def latch_path_exists(remote_path, ttl=60):
+    """
+    Whether remote_path exists on Latch Data, using a single metadata lookup rather than constructing
+    a LatchDir/LatchFile. Both positive and negative results are cached for ttl seconds.
+    """
+    cached = _latch_path_exists_cache.get(remote_path)
+    if cached is not None and cached[1] > time.monotonic():
+        return cached[0]
+
+    try:
+        LPath(remote_path).node_id()
+        exists = True
+    except LatchPathError:
+        exists = False
+    _latch_path_exists_cache[remote_path] = (exists, time.monotonic() + ttl)
+    return exists
+
+
+@contextlib.contextmanager
+def _upload_lock(remote_path):
+    # Cross-process file lock, so test modules run in parallel (e.g. one process per module) only serialize
+    #   the upload of a shared asset rather than uploading it concurrently.
+    lock_name = f"latch_upload_{hashlib.md5(remote_path.encode()).hexdigest()}.lock"
+    with open(os.path.join(tempfile.gettempdir(), lock_name), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def ensure_latch_asset(local_path, remote_path, is_dir, prepare=None):
+    """
+    Return a handle to a test asset on Latch, uploading it from local_path first if it is missing.
+
+    Args:
+        prepare: Optional callable run before uploading (e.g. to unpack the local asset).
+    """
+    if remote_path in _latch_assets:
+        return _latch_assets[remote_path]
+
+    latch_type = cached_latch_dir if is_dir else cached_latch_file
+    if latch_path_exists(remote_path):
+        print(f"Successfully detected test asset on Latch at {remote_path}")
+        asset = latch_type(remote_path)
+    else:
+        with _upload_lock(remote_path):
+            # Another test process may have uploaded the asset while this one waited on the lock.
+            _latch_path_exists_cache.pop(remote_path, None)
+            if not latch_path_exists(remote_path):
+                if prepare is not None:
+                    prepare()
+                print(f'Uploading {local_path} to Latch at {remote_path}')
+                # A failed upload raises CalledProcessError, so no separate existence check is needed.
+                subprocess.run(['latch', 'cp', local_path, remote_path], check=True, stdout=subprocess.DEVNULL)
+                _latch_path_exists_cache.pop(remote_path, None)
+        asset = latch_type(remote_path)
+    _latch_assets[remote_path] = asset
+    return asset
+
+
+@functools.lru_cache(maxsize=8)
+def _latest_log(logs_dir, dir_mtime):
+    # dir_mtime is only part of the cache key, so a new log file in logs_dir invalidates the entry.
+    #   All entries share logs_dir as prefix, so the max path is also the max file name.
+    with os.scandir(logs_dir) as it:
+        latest = max((entry.path for entry in it
+                      if entry.name.startswith('pipseeker') and entry.name.endswith('.log') and entry.is_file()),
+                     default=None)
+    if latest is None:
+        raise FileNotFoundError(f'no pipseeker log in {logs_dir}')
+    return latest
+
+
+def _alternation(needles):
+    # Regex alternation matching any of needles (all str or all bytes).
+    separator = b'|' if isinstance(needles[0], bytes) else '|'
+    return separator.join(re.escape(needle) for needle in needles)
+
+
+@functools.lru_cache(maxsize=32)
+def _lookahead_pattern(needles, ignore_case):
+    # Compiled once per marker set (a tuple of needles), since tests reuse the same markers.
+    #   The lookahead matches at every position, so overlapping occurrences are not skipped.
+    #   Longer needles are tried first; shorter needles sharing a start position are recovered by the caller.
+    alternation = _alternation(sorted(needles, key=len, reverse=True))
+    lookahead = (b'(?=(%s))' if isinstance(alternation, bytes) else '(?=(%s))') % alternation
+    return re.compile(lookahead, flags=re.IGNORECASE if ignore_case else 0)
+
+
+@functools.lru_cache(maxsize=32)
+def _alternation_pattern(needles, ignore_case):
+    # Compiled once per marker set (a tuple of needles).
+    return re.compile(_alternation(needles), flags=re.IGNORECASE if ignore_case else 0)
+
+
+def find_substrings(text, needles, ignore_case=False):
+    # Return the subset of needles that occur in text, using a single pass over text.
+    #   text and needles can be str, or bytes-like (e.g. an mmap) and bytes.
+    #   The pass stops as soon as every needle has been seen.
+    fold = (lambda needle: needle.lower()) if ignore_case else (lambda needle: needle)
+    remaining = {fold(needle) for needle in needles}
+    if not remaining:
+        return set()
+    pattern = _lookahead_pattern(tuple(sorted(remaining)), ignore_case)
+    for match in pattern.finditer(text):
+        hit = fold(match.group(1))
+        remaining = {needle for needle in remaining if needle not in hit}
+        if not remaining:
+            break
+    return {needle for needle in needles if fold(needle) not in remaining}
+
+
+def search_any(text, needles, ignore_case=False):
+    # Return the first of needles found in text, or None if none of them occur.
+    if not needles:
+        return None
+    match = _alternation_pattern(tuple(needles), ignore_case).search(text)
+    return match.group(0) if match else None
+
+
+@functools.lru_cache(maxsize=8)
+def _read_log(path, mtime):
+    # mtime is only part of the cache key, so appending to the log invalidates the entry.
+    with open(path) as fid:
+        return fid.read()
+
+
+def latest_log_file(logs_dir):
+    # Path of the most recent pipseeker*.log file in logs_dir.
+    return _latest_log(logs_dir, os.stat(logs_dir).st_mtime_ns)
+
+
+def list_dir_names(dir):
+    # Names (not full paths) of the entries in dir.
+    with os.scandir(dir) as it:
+        return frozenset(entry.name for entry in it)
 
 
 class UnitTest(unittest.TestCase):
@@ -30,4 +200,64 @@ class UnitTest(unittest.TestCase):
 
     def tearDown(self):
         # Delete the temporary directory.
-        shutil.rmtree(self.temp_dir)
\ No newline at end of file
+        shutil.rmtree(self.temp_dir)
+
+    def get_latest_log_file(self, logs_dir=None):
+        if logs_dir is None:
+            logs_dir = self.logs_dir
+        return latest_log_file(logs_dir)
+
+    def verify_log_file(self, logs_dir=None, log_file=None, **kwargs):
+        if log_file is None:
+            log_file = self.get_latest_log_file(logs_dir=logs_dir)
+        if kwargs.get('exact') is not None or not kwargs.get('case_sensitive', True):
+            # Exact and case-insensitive matches need the whole log as text.
+            text = _read_log(log_file, os.stat(log_file).st_mtime_ns)
+        else:
+            # Plain membership checks: verify_file_content memory maps the log.
+            text = None
+        self.verify_file_content(log_file, text=text, **kwargs)
+
+    def verify_file_content(self, filename, included=[], excluded=[], msg=None, exact=None, case_sensitive=True,
+                            text=None):
+        # A helper to verify the content of any text file.
+        # included and excluded can be a string or a list of strings.
+        # text can be passed in when the file content has already been read (e.g. cached log files).
+
+        if type(included) is str:
+            included = [included]
+        if type(excluded) is str:
+            excluded = [excluded]
+
+        # Case-insensitive matching is left to the regex engine, rather than lowercasing a copy of the text.
+        ignore_case = not case_sensitive
+
+        if text is None and not ignore_case and exact is None and os.path.getsize(filename) > 0:
+            # Membership checks only: search a read-only memory map of the file,
+            #   which avoids reading and decoding the whole file into a str.
+            with open(filename, 'rb') as fid, mmap.mmap(fid.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                found = {needle.decode() for needle in find_substrings(mm, [s.encode() for s in included])}
+                excluded_str = search_any(mm, [s.encode() for s in excluded])
+            if excluded_str is not None:
+                excluded_str = excluded_str.decode()
+        else:
+            if text is None:
+                with open(filename) as fid:
+                    text = fid.read()
+            found = find_substrings(text, included, ignore_case=ignore_case)
+            excluded_str = search_any(text, excluded, ignore_case=ignore_case)
+
+        for included_str in included:
+            self.assertTrue(included_str in found,
+                            msg='String "%s" not found in file %s, %s' % (included_str, filename, msg))
+        self.assertIsNone(excluded_str,
+                          msg='String "%s" unexpectedly found in file %s, %s' % (excluded_str, filename, msg))
+        if exact is not None:
+            self.assertEqual(text.lower() if ignore_case else text, exact, msg=msg)
+
+    def verify_dir_ls(self, dir, expected, msg=None):
+        # Verify directory contents against a list of expected files (names only, not full path).
+        # expected can be passed as a frozenset to skip rebuilding it on every call.
+        if not isinstance(expected, frozenset):
+            expected = frozenset(expected)
+        self.assertEqual(list_dir_names(dir), expected, msg=msg)
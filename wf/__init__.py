@@ -213,6 +213,16 @@ full_mode_parameters = {
         description="The total number of reads in the provided fastq, needed only when downsampling. "
                     "If not provided, reads will be counted manually."
     ),
+    "input_bytes": LatchParameter(
+        display_name="Input FASTQ Size (Bytes)",
+        description="Total size of the input fastqs, if known. Used only to size the task's CPU, RAM and disk "
+                    "without listing the FASTQ directory."
+    ),
+    "estimate_size_from_reads": LatchParameter(
+        display_name="Estimate Input Size from Number of Input Reads",
+        description="Estimate the input fastqs size from the number of input reads (~200 bytes per read) "
+                    "instead of listing the FASTQ directory. Used only for resource allocation."
+    ),
     "retain_barcoded_fastqs": LatchParameter(
         display_name="Retain Barcoded FASTQs",
         batch_table_column=True,
@@ -402,6 +412,8 @@ full_mode_spoiler_section = Section("",
                                         Params(
                                             "downsample_to",
                                             "input_reads",
+                                            "input_bytes",
+                                            "estimate_size_from_reads",
                                             "retain_barcoded_fastqs",
                                         ),
                                     ),
@@ -580,6 +592,8 @@ def pipseeker_wf(*,
                  dpi: int = 200,
                  downsample_to: Optional[int] = None,
                  input_reads: Optional[int] = None,
+                 input_bytes: Optional[int] = None,
+                 estimate_size_from_reads: bool = False,
                  retain_barcoded_fastqs: bool = False,
                  sorted_bam: bool = False,
                  remove_bam: bool = False,
@@ -659,7 +673,9 @@ def pipseeker_wf(*,
                           prebuilt_genome=prebuilt_genome, custom_prebuilt_genome=custom_prebuilt_genome,
                           custom_prebuilt_genome_zipped=custom_prebuilt_genome_zipped, verbosity=verbosity,
                           random_seed=random_seed, save_svg=save_svg, dpi=dpi, downsample_to=downsample_to,
-                          input_reads=input_reads, retain_barcoded_fastqs=retain_barcoded_fastqs, sorted_bam=sorted_bam,
+                          input_reads=input_reads, input_bytes=input_bytes,
+                          estimate_size_from_reads=estimate_size_from_reads,
+                          retain_barcoded_fastqs=retain_barcoded_fastqs, sorted_bam=sorted_bam,
                           remove_bam=remove_bam, exons_only=exons_only, min_sensitivity=min_sensitivity,
                           max_sensitivity=max_sensitivity, force_cells=force_cells, run_barnyard=run_barnyard,
                           clustering_percent_genes=clustering_percent_genes, diff_exp_genes=diff_exp_genes,
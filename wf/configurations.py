@@ -1,7 +1,21 @@
 from enum import Enum
+import contextlib
+import io
+import os
+import shutil
 import subprocess
+import tarfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from latch.types import LatchFile
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import rapidgzip
+except ImportError:
+    rapidgzip = None
 
 
 class GenomeType(Enum):
@@ -22,8 +36,12 @@ prebuilt_genome_dict = {GenomeType.human: "s3://latch-public/test-data/18440/pip
                         GenomeType.arabidopsis_thaliana: "s3://latch-public/test-data/18440/pipseeker-gex-reference-arabidopsis-thaliana-TAIR10.55-protein-coding-2023.02.tar.gz"
                         }
 
+# Local directory each prebuilt reference unpacks to (the tarball name without its extensions).
+prebuilt_genome_local_paths = {genome: Path("/root") / Path(s3_url).name.split(".tar")[0]
+                               for genome, s3_url in prebuilt_genome_dict.items()}
+
 
-class PIPseekerMode(Enum):
+class PIPseekerMode(str, Enum):
     full = 'full_mode'
     cells = 'cells_mode'
     buildmapref = 'buildmapref_mode'
@@ -47,11 +65,204 @@ class ClusteringSensitivity(Enum):
     high = "high"
 
 
+# Leading bytes of the archive formats recognized by sniff_archive_format.
+ARCHIVE_MAGIC_BYTES = ((b"\x1f\x8b", "gz"),
+                       (b"PK\x03\x04", "zip"),
+                       (b"\xfd7zXZ\x00", "xz"),
+                       (b"BZh", "bz2"))
+
+
+def sniff_archive_format(path):
+    # Identify an archive from its first bytes; returns None for unrecognized files.
+    with open(path, "rb") as f:
+        header = f.read(6)
+    return next((fmt for magic, fmt in ARCHIVE_MAGIC_BYTES if header.startswith(magic)), None)
+
+
+# tarfile's "data" extraction filter (Python 3.12, backported to 3.8.17+ / 3.11.4+).
+_TARFILE_HAS_DATA_FILTER = hasattr(tarfile, "data_filter")
+
+
+def safe_extractall(tf, dest):
+    """
+    tarfile.extractall for user-supplied archives: refuse members that would land outside dest (absolute paths,
+    ".." components, links pointing out of dest), as `tar -x` does.
+    """
+    if _TARFILE_HAS_DATA_FILTER:
+        tf.extractall(dest, filter="data")
+        return
+    # Iterate rather than getmembers(), so this also works on streamed ("r|") archives.
+    for member in tf:
+        names = [member.name] + ([member.linkname] if member.issym() or member.islnk() else [])
+        for name in names:
+            if os.path.isabs(name) or ".." in Path(name).parts:
+                raise tarfile.TarError(f"Refusing to extract {member.name!r} outside of {dest}.")
+        tf.extract(member, dest)
+
+
+def extract_tar_gz(source, dest="/root"):
+    """
+    Unpack a .tar.gz archive into dest.
+
+    Local archives are decompressed in parallel with rapidgzip when it is installed. Otherwise (and for streams),
+    decompression runs through pigz piped into tar when pigz is installed, falling back to tarfile.
+
+    Args:
+        source: Local path to the archive, or a readable binary stream of it (e.g. an HTTP response body).
+    """
+    is_path = isinstance(source, (str, os.PathLike))
+    if is_path and rapidgzip is not None:
+        # rapidgzip indexes the (seekable) local archive and inflates chunks on all cores.
+        with rapidgzip.RapidgzipFile(str(source), parallelization=os.cpu_count(), chunk_size=4 * 1024 ** 2) as gz:
+            with tarfile.open(fileobj=gz, mode="r|") as tf:
+                safe_extractall(tf, dest)
+        return
+
+    if shutil.which("pigz") is None:
+        with tarfile.open(source, mode="r:gz") if is_path else tarfile.open(fileobj=source, mode="r|gz") as tf:
+            safe_extractall(tf, dest)
+        return
+
+    pipe_into_tar(["pigz", "-dc"], source, dest)
+
+
+def extract_tar_xz(archive_p, dest="/root"):
+    """
+    Unpack a local .tar.xz archive into dest, decompressing in parallel with pixz when it is installed
+    and falling back to tarfile otherwise.
+    """
+    if shutil.which("pixz") is None:
+        with tarfile.open(archive_p, mode="r:xz") as tf:
+            safe_extractall(tf, dest)
+        return
+    pipe_into_tar(["pixz", "-d"], archive_p, dest)
+
+
+def pipe_into_tar(decompress_cmd, source, dest):
+    """
+    Run decompress_cmd (compressed archive on stdin, tarball on stdout) piped into tar, unpacking into dest.
+
+    Args:
+        source: Local path to the archive, or a readable binary stream of it.
+    """
+    is_path = isinstance(source, (str, os.PathLike))
+    with open(source, "rb") if is_path else contextlib.nullcontext() as archive_f:
+        decompress = subprocess.Popen(decompress_cmd, stdin=archive_f if is_path else subprocess.PIPE,
+                                      stdout=subprocess.PIPE)
+        tar = subprocess.Popen(["tar", "-xf", "-", "-C", str(dest)], stdin=decompress.stdout)
+        decompress.stdout.close()  # tar owns the read end of the pipe now.
+        try:
+            if not is_path:
+                with decompress.stdin:
+                    shutil.copyfileobj(source, decompress.stdin, 1024 ** 2)
+        finally:
+            decompress_returncode = decompress.wait()
+            tar_returncode = tar.wait()
+    if decompress_returncode != 0:
+        raise subprocess.CalledProcessError(decompress_returncode, decompress_cmd)
+    if tar_returncode != 0:
+        raise subprocess.CalledProcessError(tar_returncode, tar.args)
+
+
+def extract_zip(archive_p, dest="/root"):
+    """
+    Unpack a .zip archive into dest, inflating members in parallel.
+
+    Members are dealt round-robin (largest first) to the workers, and each worker opens its own ZipFile,
+    since a ZipFile handle is not safe to share across threads.
+    """
+    with zipfile.ZipFile(archive_p) as zf:
+        members = zf.infolist()
+    # Create the directory tree up front, so workers don't race on makedirs. Unlike ZipFile.extract, this joins the
+    #   raw member names, so refuse any that resolve outside of dest.
+    dest_real = os.path.realpath(dest)
+    for member in members:
+        parent = member.filename if member.is_dir() else os.path.dirname(member.filename)
+        if parent:
+            parent_p = os.path.realpath(os.path.join(dest, parent))
+            if os.path.commonpath([dest_real, parent_p]) != dest_real:
+                raise zipfile.BadZipFile(f"Refusing to extract {member.filename!r} outside of {dest}.")
+            os.makedirs(parent_p, exist_ok=True)
+
+    files = sorted((m for m in members if not m.is_dir()), key=lambda m: m.file_size, reverse=True)
+    num_workers = max(1, min(os.cpu_count() or 1, len(files)))
+    batches = [files[i::num_workers] for i in range(num_workers)]
+
+    def extract_batch(batch):
+        with zipfile.ZipFile(archive_p) as worker_zf:
+            for member in batch:
+                worker_zf.extract(member, dest)
+
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        list(executor.map(extract_batch, batches))
+
+
+# Shared HTTP session for the public bucket, so repeated HEAD/GET requests reuse the open TLS connection.
+#   Transient connection errors and 5xx responses are retried with backoff.
+http_session = requests.Session()
+http_session.mount("https://", HTTPAdapter(pool_maxsize=32,
+                                           max_retries=Retry(total=3, backoff_factor=0.3,
+                                                             status_forcelist=(500, 502, 503, 504))))
+
+
+def public_s3_https_url(s3_url):
+    # Objects in the latch-public bucket are readable over plain HTTPS.
+    return s3_url.replace("s3://latch-public/", "https://latch-public.s3.amazonaws.com/")
+
+
+def stream_s3_tar_to_dir(s3_url, dest="/root"):
+    """
+    Download a public .tar.gz and unpack it into dest in a single pass, without writing the archive to disk.
+    The response body is read in 256 KiB blocks so the download overlaps with decompression.
+    """
+    with http_session.get(public_s3_https_url(s3_url), stream=True, timeout=60) as response:
+        response.raise_for_status()
+        extract_tar_gz(io.BufferedReader(response.raw, buffer_size=256 * 1024), dest=dest)
+
+
+def download_prebuilt_reference(s3_url, dest="/root"):
+    """Download and unpack a prebuilt reference tarball into dest."""
+    # Stream the tarball from the public bucket straight into the extractor, so the download overlaps
+    #   with decompression and the compressed copy never lands on disk.
+    try:
+        stream_s3_tar_to_dir(s3_url, dest=dest)
+    except (requests.exceptions.RequestException, tarfile.TarError, subprocess.CalledProcessError,
+            OSError) as e:
+        # Fall back to downloading the LatchFile and unpacking it from disk.
+        print(f"Streaming the prebuilt reference failed ({e}). Downloading it instead.")
+        # Imported here so modules that only need the enums don't pay for loading the Latch SDK.
+        from latch.types import LatchFile
+        reference_zipped_p = LatchFile(s3_url).local_path
+        extract_tar_gz(reference_zipped_p, dest=dest)
+
+
+def fetch_prebuilt_reference(s3_url, reference_p):
+    """
+    Download and unpack the prebuilt reference into /root, and check that it unpacked to reference_p.
+
+    Task containers start fresh, so there is no local copy to reuse between runs.
+    """
+    download_prebuilt_reference(s3_url)
+    if not reference_p.is_dir():
+        raise ValueError(f"Unpacking the prebuilt reference {s3_url} did not produce the directory {reference_p}.")
+
+
+def path_key(path):
+    # Stable cache key for a LatchFile/LatchDir (by remote path) or a plain local path.
+    if path is None:
+        return None
+    return getattr(path, 'remote_path', None) or str(path)
+
+
+# Prepared (downloaded and unpacked) references, keyed by the normalized get_mapping_reference inputs.
+_prepared_references = {}
+
 
 def get_mapping_reference(*, genome_source, prebuilt_genome, custom_prebuilt_genome,
                           custom_prebuilt_genome_zipped, get_path_only=False):
     """
     Download and unpack prebuilt mapping references (using Fluent-built or custom).
+    A reference is only prepared once per process; repeat calls return the cached path.
 
     Args:
         get_path_only: Return only the compressed file path for filesize estimation (dynamic resource allocation).
@@ -59,6 +270,24 @@ def get_mapping_reference(*, genome_source, prebuilt_genome, custom_prebuilt_gen
     Returns:
         reference_p: Path to the prebuilt mapping reference.
     """
+    if get_path_only:
+        return _get_mapping_reference(genome_source=genome_source, prebuilt_genome=prebuilt_genome,
+                                      custom_prebuilt_genome=custom_prebuilt_genome,
+                                      custom_prebuilt_genome_zipped=custom_prebuilt_genome_zipped,
+                                      get_path_only=True)
+
+    cache_key = (genome_source, prebuilt_genome, path_key(custom_prebuilt_genome),
+                 path_key(custom_prebuilt_genome_zipped))
+    if cache_key not in _prepared_references:
+        _prepared_references[cache_key] = _get_mapping_reference(
+            genome_source=genome_source, prebuilt_genome=prebuilt_genome,
+            custom_prebuilt_genome=custom_prebuilt_genome,
+            custom_prebuilt_genome_zipped=custom_prebuilt_genome_zipped)
+    return _prepared_references[cache_key]
+
+
+def _get_mapping_reference(*, genome_source, prebuilt_genome, custom_prebuilt_genome,
+                           custom_prebuilt_genome_zipped, get_path_only=False):
     if not get_path_only:
         print("\nPreparing reference genome")
 
@@ -72,18 +301,9 @@ def get_mapping_reference(*, genome_source, prebuilt_genome, custom_prebuilt_gen
             return s3_url
 
         else:
-            # Proceed to configure the LatchFile instance.
-            reference_zipped_p = LatchFile(s3_url).local_path
-            unpacked_name = Path(s3_url).stem.split('.tar')[0]
-            reference_p = Path(f"/root/{unpacked_name}")
-
-            # Unpack the prebuilt reference.
-            subprocess.run(
-                ["tar", "-zxvf", f"{reference_zipped_p}", "-C", "/root"],
-                check=True,
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL,
-            )
+            reference_p = prebuilt_genome_local_paths[prebuilt_genome]
+
+            fetch_prebuilt_reference(s3_url, reference_p)
 
     # Using a custom prebuilt mapping reference.
     elif genome_source == "custom_prebuilt_genome":
@@ -101,22 +321,18 @@ def get_mapping_reference(*, genome_source, prebuilt_genome, custom_prebuilt_gen
 
             print("Unpacking the custom prebuilt genome")
             unpacked_data = False  # Tracks whether the untar/unzip operation was attempted.
-            if reference_zipped_p.suffixes[-2:] == [".tar", ".gz"]:
-                subprocess.run(
-                    ["tar", "-zxvf", str(reference_zipped_p), "-C", "/root"],
-                    check=True,
-                    stdout=subprocess.DEVNULL,
-                    stderr=subprocess.DEVNULL,
-                )
+            # Dispatch on the file's magic bytes rather than its (user-chosen) name.
+            archive_format = sniff_archive_format(reference_zipped_p)
+            if archive_format == "gz":
+                extract_tar_gz(reference_zipped_p)
+                unpacked_data = True
+
+            elif archive_format == "zip":
+                extract_zip(reference_zipped_p)
                 unpacked_data = True
 
-            elif reference_zipped_p.suffix == ".zip":
-                subprocess.run(
-                    ["unzip", "-o", str(reference_zipped_p), "-d", "/root"],
-                    check=True,
-                    stdout=subprocess.DEVNULL,
-                    stderr=subprocess.DEVNULL,
-                )
+            elif archive_format == "xz":
+                extract_tar_xz(reference_zipped_p)
                 unpacked_data = True
 
             # Check whether the uncompressed directory exists and matches the expected name.
@@ -124,12 +340,8 @@ def get_mapping_reference(*, genome_source, prebuilt_genome, custom_prebuilt_gen
                 #   This handles the case where users might not pack their data inside of a single directory
                 #   or the top-level zipped dir might use a different name than the parent zipped filename.
                 #   If the directory is not found, the user will be prompted to re-upload the data.
-                # List the files in the root dir and see if the directory name is present from the zipped file output
-                root_dir = Path("/root")
-                root_dir_files = [f.name for f in root_dir.iterdir()]
-
-                # Check if the directory name is present in the root dir
-                if not reference_zipped_p.stem in root_dir_files:
+                # Check if the directory name from the zipped file output is present in the root dir.
+                if not reference_p.exists():
                     raise ValueError(f"Unpacking failed. The directory {reference_p} was not found.\n"
                                      "Please ensure that you compressed your reference with a single top-level "
                                      "directory containing the reference genome. \n"
@@ -137,7 +349,7 @@ def get_mapping_reference(*, genome_source, prebuilt_genome, custom_prebuilt_gen
 
             else:
                 # Data was not unpacked, due to file extension mismatch.
-                print('The provided genome must be compressed using .tar.gz or .zip format '
+                print('The provided genome must be compressed using .tar.gz, .tar.xz or .zip format '
                       'or uploaded without compression.')
     else:
         print("No reference genome provided. Continuing.")
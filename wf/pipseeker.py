@@ -1,3 +1,5 @@
+import gc
+import shlex
 import subprocess
 import sys
 
@@ -5,12 +7,42 @@ from pathlib import Path
 from typing import Optional
 from latch import custom_task
 from latch.functions.messages import message
+from latch.ldata.path import LPath
 from latch.types import LatchDir, LatchFile, LatchOutputDir
 from wf.configurations import GenomeType, PIPseekerMode, Chemistry, Verbosity, ClusteringSensitivity, get_mapping_reference
 from wf.resource_estimator import get_num_threads, get_memory_requirement_gb, get_disk_requirement_gb
 
 sys.stdout.reconfigure(line_buffering=True)
 
+# Args passed to every pipseeker mode regardless of the task inputs.
+STATIC_SHARED_ARGS = ("--threads", "0", "--skip-version-check")
+
+
+def optional_args(pairs):
+    # Flatten (flag, value) pairs into CLI args, skipping values that are not set (None).
+    return [arg for flag, value in pairs if value is not None for arg in (flag, str(value))]
+
+
+def flag_args(pairs):
+    # Boolean CLI flags, passed only when their value is True.
+    return [flag for flag, enabled in pairs if enabled is True]
+
+
+def upload_partial_output(local_output_dir, destination_directory):
+    """
+    Upload whatever a failed PIPseeker run left in local_output_dir (logs in particular) to destination_directory.
+
+    The trailing "/" uploads the directory's contents, so they land where a successful run's LatchOutputDir
+    would put them rather than nested under the local directory name. Upload errors are only logged,
+    so they never mask the PIPseeker failure itself.
+    """
+    if not Path(local_output_dir).exists():
+        return
+    try:
+        LPath(destination_directory).upload_from(f"{str(local_output_dir).rstrip('/')}/")
+    except Exception as e:
+        print(f"Uploading partial results to {destination_directory} failed: {e}")
+
 
 @custom_task(cpu=get_num_threads, memory=get_memory_requirement_gb, storage_gib=get_disk_requirement_gb)
 def pipseeker_task(*,
@@ -28,6 +60,9 @@ def pipseeker_task(*,
                    dpi: int = 200,
                    downsample_to: Optional[int] = None,
                    input_reads: Optional[int] = None,
+                   # Only used for dynamic resource allocation decorator
+                   input_bytes: Optional[int] = None,
+                   estimate_size_from_reads: bool = False,
                    retain_barcoded_fastqs: bool = False,
                    sorted_bam: bool = False,
                    remove_bam: bool = False,
@@ -111,13 +146,7 @@ def pipseeker_task(*,
 
 
     # Shared args.
-    universal_shared_args = [
-        "--threads",
-        "0",
-        "--verbosity",
-        f"{verbosity.value}",
-        "--skip-version-check"
-    ]
+    universal_shared_args = STATIC_SHARED_ARGS + ("--verbosity", verbosity.value)
 
     if pipseeker_mode in [PIPseekerMode.full.value, PIPseekerMode.cells.value]:
 
@@ -126,19 +155,19 @@ def pipseeker_task(*,
         # Shared args for full and cells mode.
         full_and_cells_shared_args = [
             "--random-seed",
-            f"{random_seed}",
+            str(random_seed),
             "--dpi",
-            f"{dpi}",
+            str(dpi),
             "--min-sensitivity",
-            f"{min_sensitivity}",
+            str(min_sensitivity),
             "--max-sensitivity",
-            f"{max_sensitivity}",
+            str(max_sensitivity),
             "--clustering-percent-genes",
-            f"{clustering_percent_genes}",
+            str(clustering_percent_genes),
             "--diff-exp-genes",
-            f"{diff_exp_genes}",
+            str(diff_exp_genes),
             "--clustering-sensitivity",
-            f"{clustering_sensitivity.value}"
+            clustering_sensitivity.value
         ]
 
         # Full Mode.
@@ -161,26 +190,27 @@ def pipseeker_task(*,
                 "--fastq",
                 f"{fastq_directory.local_path}/.",  # Use period for directory input.
                 "--star-index-path",
-                f"{reference_p}",
+                str(reference_p),
                 "--chemistry",
-                f"{chemistry.value}",
+                chemistry.value,
                 "--output-path",
-                f"{local_output_dir}",
+                str(local_output_dir),
             ]
 
-            pipseeker_cmd += universal_shared_args + full_and_cells_shared_args
+            pipseeker_cmd.extend(universal_shared_args)
+            pipseeker_cmd.extend(full_and_cells_shared_args)
 
             # Add full mode specific optional vars.
             if downsample_to is not None:
-                pipseeker_cmd += [
+                pipseeker_cmd.extend((
                     "--downsample-to",
-                    f"{downsample_to}"
-                ]
+                    str(downsample_to)
+                ))
                 if input_reads is not None:
-                    pipseeker_cmd += [
+                    pipseeker_cmd.extend((
                         "--input-reads",
-                        f"{input_reads}"
-                    ]
+                        str(input_reads)
+                    ))
 
         # Cells Mode.
         elif pipseeker_mode == PIPseekerMode.cells.value:
@@ -193,74 +223,36 @@ def pipseeker_task(*,
                 "pipseeker",
                 "cells",
                 "--previous",
-                f"{local_output_dir}"
+                str(local_output_dir)
             ]
-            pipseeker_cmd += universal_shared_args + full_and_cells_shared_args
+            pipseeker_cmd.extend(universal_shared_args)
+            pipseeker_cmd.extend(full_and_cells_shared_args)
 
             # Add cells mode specific optional vars.
             if hash_cellsmode is not None:
-                pipseeker_cmd += [
+                pipseeker_cmd.extend((
                     "--hash",
-                    f"{hash_cellsmode}"
-                ]
+                    str(hash_cellsmode)
+                ))
 
         # Extend Full or Cells mode commands.
-        if force_cells is not None:
-            pipseeker_cmd += [
-                "--force-cells",
-                f"{force_cells}"
-            ]
-
-        if min_clusters_kmeans is not None:
-            pipseeker_cmd += [
-                "--min-clusters-kmeans",
-                f"{min_clusters_kmeans}"
-            ]
-
-        if max_clusters_kmeans is not None:
-            pipseeker_cmd += [
-                "--max-clusters-kmeans",
-                f"{max_clusters_kmeans}"
-            ]
-
-        if annotation is not None:
-            pipseeker_cmd += [
-                "--annotation",
-                f"{annotation.local_path}"
-            ]
-
-        if report_id is not None:
-            pipseeker_cmd += [
-                "--id",
-                f"{report_id}"
-            ]
-
-        if report_description is not None:
-            pipseeker_cmd += [
-                "--description",
-                f"{report_description}"
-            ]
-
-        if save_svg is True:
-            pipseeker_cmd.append("--save-svg")
-
-        if retain_barcoded_fastqs is True:
-            pipseeker_cmd.append("--retain-barcoded-fastqs")
-
-        if sorted_bam is True:
-            pipseeker_cmd.append("--sorted-bam")
-
-        if remove_bam is True:
-            pipseeker_cmd.append("--remove-bam")
-
-        if exons_only is True:
-            pipseeker_cmd.append("--exons-only")
-
-        if run_barnyard is True:
-            pipseeker_cmd.append("--run-barnyard")
-
-        if umap_axes is True:
-            pipseeker_cmd.append("--umap-axes")
+        pipseeker_cmd.extend(optional_args((
+            ("--force-cells", force_cells),
+            ("--min-clusters-kmeans", min_clusters_kmeans),
+            ("--max-clusters-kmeans", max_clusters_kmeans),
+            ("--annotation", annotation.local_path if annotation is not None else None),
+            ("--id", report_id),
+            ("--description", report_description),
+        )))
+        pipseeker_cmd.extend(flag_args((
+            ("--save-svg", save_svg),
+            ("--retain-barcoded-fastqs", retain_barcoded_fastqs),
+            ("--sorted-bam", sorted_bam),
+            ("--remove-bam", remove_bam),
+            ("--exons-only", exons_only),
+            ("--run-barnyard", run_barnyard),
+            ("--umap-axes", umap_axes),
+        )))
 
         parameters = [principal_components, nearest_neighbors, resolution]
 
@@ -268,14 +260,14 @@ def pipseeker_task(*,
                 param is not None for param in parameters
         ):
             if all(param is not None for param in parameters):
-                pipseeker_cmd += [
+                pipseeker_cmd.extend((
                     "--principal-components",
-                    f"{principal_components}",
+                    str(principal_components),
                     "--nearest-neighbors",
-                    f"{nearest_neighbors}",
+                    str(nearest_neighbors),
                     "--resolution",
-                    f"{resolution}",
-                ]
+                    str(resolution),
+                ))
         else:
             message(
                 typ="warning",
@@ -290,52 +282,38 @@ def pipseeker_task(*,
         if snt_fastq is not None:
             if pipseeker_mode == PIPseekerMode.full.value:
                 # The following 4 params are not supported in cells mode.
-                pipseeker_cmd += [
+                pipseeker_cmd.extend((
                     "--snt-fastq",
                     f"{snt_fastq.local_path}/.",  # Use period for directory input.
                     "--snt-position",
-                    f"{snt_position}"
-                ]
-
-                if snt_tags is not None:
-                    pipseeker_cmd += [
-                        "--snt-tags",
-                        f"{snt_tags.local_path}",
-                    ]
-
-                if snt_label is not None:
-                    pipseeker_cmd += [
-                        "--snt-label",
-                        f"{snt_label}"
-                    ]
-
-            if snt_annotation is not None:
-                pipseeker_cmd += [
-                    "--snt-annotation",
-                    f"{snt_annotation.local_path}",
-                ]
-
-            if snt_colormap is not None:
-                pipseeker_cmd += [
-                    "--snt-colormap",
-                    f"{snt_colormap}"
-                ]
+                    str(snt_position)
+                ))
+
+                pipseeker_cmd.extend(optional_args((
+                    ("--snt-tags", snt_tags.local_path if snt_tags is not None else None),
+                    ("--snt-label", snt_label),
+                )))
+
+            pipseeker_cmd.extend(optional_args((
+                ("--snt-annotation", snt_annotation.local_path if snt_annotation is not None else None),
+                ("--snt-colormap", snt_colormap),
+            )))
 
             if (snt_min_value is not None) and (snt_max_value is not None):
-                pipseeker_cmd += [
+                pipseeker_cmd.extend((
                     "--snt-min-value",
-                    f"{snt_min_value}",
+                    str(snt_min_value),
                     "--snt-max-value",
-                    f"{snt_max_value}",
-                ]
+                    str(snt_max_value),
+                ))
 
             elif (snt_min_value is None) and (snt_max_value is None):
-                pipseeker_cmd += [
+                pipseeker_cmd.extend((
                     "--snt-min-percent",
-                    f"{snt_min_percent}",
+                    str(snt_min_percent),
                     "--snt-max-percent",
-                    f"{snt_max_percent}",
-                ]
+                    str(snt_max_percent),
+                ))
             else:
                 message(
                     typ="warning",
@@ -348,36 +326,36 @@ def pipseeker_task(*,
         if hto_fastq is not None:
             if pipseeker_mode == PIPseekerMode.full.value:
                 # The following 3 params are not supported in cells mode.
-                pipseeker_cmd += [
+                pipseeker_cmd.extend((
                     "--hto-fastq",
                     f"{hto_fastq.local_path}/.",  # Use period for directory input.
                     "--hto-position",
-                    f"{hto_position}" ]
-
-                if hto_tags is not None:
-                    pipseeker_cmd += ["--hto-tags", f"{hto_tags.local_path}"]
+                    str(hto_position) ))
 
-            if hto_colormap is not None:
-                pipseeker_cmd += ["--hto-colormap", f"{hto_colormap}"]
+                pipseeker_cmd.extend(optional_args((
+                    ("--hto-tags", hto_tags.local_path if hto_tags is not None else None),
+                )))
 
-            if hto_colorbar is not None:
-                pipseeker_cmd += ["--hto-colorbar", f"{hto_colorbar}"]
+            pipseeker_cmd.extend(optional_args((
+                ("--hto-colormap", hto_colormap),
+                ("--hto-colorbar", hto_colorbar),
+            )))
 
             if (hto_min_value is not None) and (hto_max_value is not None):
-                pipseeker_cmd += [
+                pipseeker_cmd.extend((
                     "--hto-min-value",
-                    f"{hto_min_value}",
+                    str(hto_min_value),
                     "--hto-max-value",
-                    f"{hto_max_value}"
-                ]
+                    str(hto_max_value)
+                ))
 
             elif (hto_min_value is None) and (hto_max_value is None):
-                pipseeker_cmd += [
+                pipseeker_cmd.extend((
                     "--hto-min-percent",
-                    f"{hto_min_percent}",
+                    str(hto_min_percent),
                     "--hto-max-percent",
-                    f"{hto_max_percent}",
-                ]
+                    str(hto_max_percent),
+                ))
             else:
                 message(
                     typ="warning",
@@ -402,30 +380,30 @@ def pipseeker_task(*,
             "pipseeker",
             "buildmapref",
             "--fasta",
-            f"{custom_genome_reference_fasta_p}",
+            str(custom_genome_reference_fasta_p),
             "--gtf",
-            f"{custom_genome_reference_gtf_p}",
+            str(custom_genome_reference_gtf_p),
             "--output-path",
-            f"{local_output_dir}",
+            str(local_output_dir),
             "--read-length",
-            f"{read_length}",
+            str(read_length),
             "--sparsity",
-            f"{sparsity}"
+            str(sparsity)
         ]
 
-        pipseeker_cmd += universal_shared_args
+        pipseeker_cmd.extend(universal_shared_args)
 
         if include_types is not None and exclude_types is None:
-            pipseeker_cmd += ["--include-types", f"{include_types}"]
+            pipseeker_cmd.extend(("--include-types", str(include_types)))
 
             if biotype_tag is not None:
-                pipseeker_cmd += ["--biotype-tag", f"{biotype_tag}"]
+                pipseeker_cmd.extend(("--biotype-tag", str(biotype_tag)))
 
         elif exclude_types is not None and include_types is None:
-            pipseeker_cmd += ["--exclude-types", f"{exclude_types}"]
+            pipseeker_cmd.extend(("--exclude-types", str(exclude_types)))
 
             if biotype_tag is not None:
-                pipseeker_cmd += ["--biotype-tag", f"{biotype_tag}"]
+                pipseeker_cmd.extend(("--biotype-tag", str(biotype_tag)))
 
         elif exclude_types is not None and include_types is not None:
             message(
@@ -444,11 +422,16 @@ def pipseeker_task(*,
     # Run PIPseeker
     #############################
 
-    try:
-        print(f'Running {" ".join(pipseeker_cmd)}')
-        subprocess.run(pipseeker_cmd, check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"PIPseeker failed with exit code {e.returncode}")
-    finally:
-        print(f"Uploading results from {local_output_dir} to {destination_directory}")
-        return LatchOutputDir(str(local_output_dir), remote_path=destination_directory)
+    # PIPseeker can run for hours while this process idles, so release garbage from argument setup first.
+    gc.collect()
+    if verbosity != Verbosity.zero:
+        print("Running", shlex.join(pipseeker_cmd))
+    returncode = subprocess.run(pipseeker_cmd).returncode
+
+    print(f"Uploading results from {local_output_dir} to {destination_directory}")
+    if returncode != 0:
+        # Upload whatever PIPseeker produced (logs in particular) before failing the task,
+        #   since a raised task does not upload its returned output directory.
+        upload_partial_output(local_output_dir, destination_directory)
+        raise RuntimeError(f"PIPseeker failed with exit code {returncode}")
+    return LatchOutputDir(str(local_output_dir), remote_path=destination_directory)
@@ -1,18 +1,37 @@
+import bisect
 import os
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
 from latch.types import LatchDir, LatchFile
 import requests
-from wf.configurations import GenomeType, PIPseekerMode, get_mapping_reference
+from wf.configurations import GenomeType, PIPseekerMode, get_mapping_reference, http_session, path_key, \
+    public_s3_https_url
+
+
+# Bytes per GB (GiB); the estimator coefficients are all in GB.
+_GB = 1024 ** 3
+
+# Largest prebuilt reference (human + mouse).
+_MAX_PREBUILT_INDEX_BYTES = 24 * _GB
+
+
+# Content-Length of the public prebuilt references, keyed by s3 url. Only successful lookups are stored,
+#   so a failed HEAD is retried on the next call.
+_s3_object_size_cache = {}
 
 
 def get_s3_object_size(url):
-    # Convert the url to a format usable by response.
-    url = url.replace("s3://latch-public/", "https://latch-public.s3.amazonaws.com/")
+    if url in _s3_object_size_cache:
+        return _s3_object_size_cache[url]
     try:
-        response = requests.head(url)
+        # Bounded (connect, read) timeout so an unreachable S3 cannot stall resource estimation.
+        response = http_session.head(public_s3_https_url(url), timeout=(3, 5))
         if response.status_code == 200:
             size_in_bytes = response.headers.get('Content-Length')
-            return int(size_in_bytes) if size_in_bytes is not None else None
+            if size_in_bytes is None:
+                return None
+            _s3_object_size_cache[url] = int(size_in_bytes)
+            return _s3_object_size_cache[url]
         else:
             print(f"Failed to retrieve object: HTTP {response.status_code}")
     except requests.exceptions.RequestException as e:
@@ -29,28 +48,97 @@ def get_downsample_factor(*, downsample_to, input_reads):
     return downsample_factor
 
 
-def get_fastqs_size_bytes(*, fastq_directory, downsample_factor):
-    fastqs_size_bytes = 0
+def sum_latch_file_sizes(files, max_workers=32):
+    # Each LatchFile.size() is a remote metadata lookup, so issue them concurrently.
+    if not files:
+        return 0
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(files))) as executor:
+        return sum(executor.map(lambda file: file.size(), files))
+
+
+# File names counted as input FASTQs (str.endswith accepts the whole tuple).
+_FASTQ_EXTS = ('.fastq.gz', '.fq.gz', '.fastq', '.fq')
+
+# Total FASTQ size per directory, keyed by path_key. The memory, disk and thread estimators all size
+#   the same directories, so each is only listed once.
+_fastqs_size_cache = {}
+
+
+def _sum_s3_fastqs_size_bytes(s3_url):
+    """
+    Total FASTQ size under an s3:// directory from one paginated bucket listing, which already carries each
+    object's size. Delimiter keeps the listing to the top level, like iterdir().
+
+    Returns None if the bucket cannot be listed directly (e.g. no credentials, AccessDenied), so the caller can
+    fall back to the Latch listing.
+    """
+    import boto3
+    from botocore.exceptions import BotoCoreError, ClientError
+
+    bucket, _, prefix = s3_url[len('s3://'):].partition('/')
+    if prefix and not prefix.endswith('/'):
+        prefix += '/'
+    try:
+        paginator = boto3.client('s3').get_paginator('list_objects_v2')
+        return sum(obj['Size']
+                   for page in paginator.paginate(Bucket=bucket, Prefix=prefix, Delimiter='/')
+                   for obj in page.get('Contents', [])
+                   if obj['Key'].endswith(_FASTQ_EXTS))
+    except (BotoCoreError, ClientError) as e:
+        print(f"Listing {s3_url} directly failed ({e}). Sizing the FASTQs through Latch instead.")
+        return None
+
+
+def _get_raw_fastqs_size_bytes(fastq_directory):
+    dir_key = path_key(fastq_directory)
+    if dir_key not in _fastqs_size_cache:
+        fastqs_size_bytes = None
+        if dir_key.startswith('s3://'):
+            fastqs_size_bytes = _sum_s3_fastqs_size_bytes(dir_key)
+        if fastqs_size_bytes is None:
+            fastq_files = [file for file in fastq_directory.iterdir()  # Using iterdir() to iterate over contents
+                           if isinstance(file, LatchFile) and file.path.endswith(_FASTQ_EXTS)]
+            fastqs_size_bytes = sum_latch_file_sizes(fastq_files)
+        _fastqs_size_cache[dir_key] = fastqs_size_bytes
+    return _fastqs_size_cache[dir_key]
+
+
+# Rough compressed size of one read pair in a .fastq.gz, used to estimate the input size from input_reads.
+AVG_BYTES_PER_READ = 200
+
+
+def _get_input_fastqs_size_bytes(*, fastq_directory, input_bytes=None, input_reads=None, estimate_from_reads=False):
+    # Not downsampled. A known input_bytes (or, when opted in, an estimate from input_reads) skips listing the directory.
+    if input_bytes is not None:
+        return input_bytes
+    if estimate_from_reads and input_reads:
+        return input_reads * AVG_BYTES_PER_READ
     if fastq_directory is not None:
-        for file in fastq_directory.iterdir():  # Using iterdir() to iterate over contents
-            if isinstance(file, LatchFile) and file.path.endswith('.fastq.gz'):
-                fastqs_size_bytes += file.size()
-        fastqs_size_gb = fastqs_size_bytes / 1024 ** 3
-        print(f'Input FASTQs size: {fastqs_size_gb:.2f} GB')
+        return _get_raw_fastqs_size_bytes(fastq_directory)
+    return 0
+
+
+def get_fastqs_size_bytes(*, fastq_directory, downsample_factor, input_bytes=None, input_reads=None,
+                          estimate_from_reads=False):
+    fastqs_size_bytes = _get_input_fastqs_size_bytes(fastq_directory=fastq_directory, input_bytes=input_bytes,
+                                                     input_reads=input_reads,
+                                                     estimate_from_reads=estimate_from_reads)
+    if fastqs_size_bytes:
+        print(f'Input FASTQs size: {fastqs_size_bytes / _GB:.2f} GB')
         if downsample_factor is not None:
-            fastqs_size_gb *= downsample_factor
+            # Downsampling can only reduce the input, so a target above input_reads leaves it as is.
+            fastqs_size_bytes = int(fastqs_size_bytes * min(downsample_factor, 1))
     return fastqs_size_bytes
 
 
 def baseline_ram_estimator(*, fastqs_size_gb, num_threads):
     # Baseline RAM footprint estimation.
-    # Coefficients are in units of GB; fastqs_size is in units of bytes
-    # Convert bytes to GB before calculating; then reconvert to bytes.
+    # Coefficients and fastqs_size_gb are in units of GB; the result is converted to bytes.
 
     # Barcoding is fixed at 16 threads max, so adjust prior to calculating.
     num_threads = min(num_threads, 16)
     baseline_ram_bytes = (2.24 + (0.01 * fastqs_size_gb) +
-                                      (0.0011 * num_threads * fastqs_size_gb)) * 1024 ** 3
+                                      (0.0011 * num_threads * fastqs_size_gb)) * _GB
     return baseline_ram_bytes
 
 
@@ -59,19 +147,52 @@ def barcoding_ram_estimator(*, baseline_ram_bytes, num_threads):
     # Coefficients are in units of GB; baseline_ram is in bytes; converting all but baseline_ram to bytes.
     # Since we can't easily measure the r1+r2 length here, we will default to a max expected value of 300bp.
     r1r2_length_sum = 300  # have to default to max of 300 since can't measure here.
-    barcoding_ram = 1024 ** 3 * (
+    barcoding_ram = _GB * (
             (1.23 * num_threads) + (0.0166 * r1r2_length_sum) + (0.009 * num_threads * r1r2_length_sum))
     barcoding_ram_bytes = baseline_ram_bytes + barcoding_ram
     return barcoding_ram_bytes
 
 
+# Unpacked / packed size ratio of a STAR index archive, keyed by its final suffix (".gz" for "STAR_index.tar.gz").
+#   A plain tar only adds headers; gzip and zip shrink STAR's Genome/SA files roughly 3-4x.
+_UNPACK_RATIOS = {'.tar': 1.02, '.gz': 3.5, '.tgz': 3.5, '.zip': 3.2}
+
+# Mapping reference size estimates, keyed by the normalized estimator inputs (see path_key).
+_mapping_ref_size_cache = {}
+
+
 def mapping_ref_size_estimator(*, genome_source, prebuilt_genome, custom_prebuilt_genome,
                                custom_prebuilt_genome_zipped):
     """
     Estimate the size of the mapping reference, depending on whether it is compressed or not.
-    For simplicity, we take the size as 1.25x the size of the reference genome, which is equivalent to the
-        filesize reduction using the maximum gzip compression level.
+    For an archive, the unpacked size is estimated from the archive size with a per-format ratio (see _UNPACK_RATIOS).
+
+    Results are cached per reference, since both the memory and disk estimators size the same reference.
     """
+    cache_key = (genome_source, prebuilt_genome, path_key(custom_prebuilt_genome),
+                 path_key(custom_prebuilt_genome_zipped))
+    if cache_key not in _mapping_ref_size_cache:
+        _mapping_ref_size_cache[cache_key] = _estimate_mapping_ref_size(
+            genome_source=genome_source, prebuilt_genome=prebuilt_genome,
+            custom_prebuilt_genome=custom_prebuilt_genome,
+            custom_prebuilt_genome_zipped=custom_prebuilt_genome_zipped)
+    return _mapping_ref_size_cache[cache_key]
+
+
+def _dir_size_bytes(path):
+    # Total size of the files under path, including nested directories (like `du`), with one scandir per directory.
+    total = 0
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                total += _dir_size_bytes(entry.path)
+            elif entry.is_file():
+                total += entry.stat().st_size
+    return total
+
+
+def _estimate_mapping_ref_size(*, genome_source, prebuilt_genome, custom_prebuilt_genome,
+                               custom_prebuilt_genome_zipped):
     star_index_size_bytes = 0
 
     reference_p = get_mapping_reference(genome_source=genome_source, prebuilt_genome=prebuilt_genome,
@@ -88,7 +209,7 @@ def mapping_ref_size_estimator(*, genome_source, prebuilt_genome, custom_prebuil
         if star_index_size_bytes is None:
             #  response failed to obtain the size for the reference.
             #   Set default value (max size prebuilt ref is human + mouse, 24GB) and print warning.
-            star_index_size_bytes = 24 * 1024 ** 3
+            star_index_size_bytes = _MAX_PREBUILT_INDEX_BYTES
         return star_index_size_bytes
 
     # Check whether the following file extensions are present in the reference path.
@@ -96,23 +217,23 @@ def mapping_ref_size_estimator(*, genome_source, prebuilt_genome, custom_prebuil
     if reference_p:
         if reference_p.suffixes:
             # Input is a file. Check suffixes to confirm is compressed.
-            if any([ext == reference_p.suffixes[0] for ext in ['.tar', '.tar.gz', '.zip']]):
+            unpack_ratio = _UNPACK_RATIOS.get(reference_p.suffixes[-1])
+            if unpack_ratio is not None:
                 # Returns the unpacked reference size estimate.
-                star_index_size_bytes = 1.25 * os.path.getsize(reference_p)
+                star_index_size_bytes = unpack_ratio * os.path.getsize(reference_p)
             else:
                 star_index_size_bytes = os.path.getsize(reference_p)
         else:
             # Input is a directory. Iterate over contents to get size.
             try:
-                star_index_size_bytes = sum(
-                    [os.path.getsize(os.path.join(reference_p, p)) for p in os.listdir(reference_p)])
-            except:
-                ValueError(f"Could not calculate the size of the reference genome directory at {reference_p}. \n"
-                           f"Folder contents: {os.listdir(reference_p)}")
+                star_index_size_bytes = _dir_size_bytes(reference_p)
+            except OSError as e:
+                raise ValueError(f"Could not calculate the size of the reference genome directory at {reference_p}."
+                                 ) from e
     else:
         print('No reference path was found. Continuing without reference genome size estimation.')
 
-    print(f'STAR index size: {star_index_size_bytes / 1024**3:.3f} GB  for {reference_p}')
+    print(f'STAR index size: {star_index_size_bytes / _GB:.3f} GB  for {reference_p}')
     return star_index_size_bytes
 
 
@@ -127,7 +248,7 @@ def star_ram_estimator(*, star_index_size_bytes, num_threads, baseline_ram_bytes
         safety_margin: Adds a 10% safety margin for case of STAR without counting.
     """
     # Baseline RAM requirement is added below.
-    star_ram_bytes = (0.93 * star_index_size_bytes) + (0.55 + (0.23 * num_threads) * 1024 ** 3)
+    star_ram_bytes = (0.93 * star_index_size_bytes) + (0.55 + 0.23 * num_threads) * _GB
 
     if not sorted_bam:
         star_ram_bytes = safety_margin * (baseline_ram_bytes + star_ram_bytes)
@@ -143,32 +264,83 @@ def molinfo_ram_estimator(*, baseline_ram_bytes, fastqs_size_bytes, num_threads,
     Coefficients are in units of GB when not multiplied by bytes data.
     Convert all GB values to bytes data aside from baseline_ram and fastqs_size, which are already in bytes units.
     """
-    fastqs_size_gb = fastqs_size_bytes / 1024 ** 3
+    fastqs_size_gb = fastqs_size_bytes / _GB
     molinfo_ram_bytes = baseline_ram_bytes + (0.772 * fastqs_size_gb) + \
-                        1024 ** 3 * ((0.54 * exons_only) + (0.525 * num_threads) +
+                        _GB * ((0.54 * exons_only) + (0.525 * num_threads) +
                                      (0.71 * num_threads * exons_only))
     return molinfo_ram_bytes
 
 
-def get_previous_dir_size(*, previous_directory: LatchDir) -> int:
-    previous_dir_size = 0
-    for file in previous_directory.iterdir():
-        if isinstance(file, LatchFile):
-            previous_dir_size += file.size()
-    previous_dir_size_bytes = int(previous_dir_size / 1024 ** 3)
-    return previous_dir_size_bytes
+def _compute_max_ram_bytes(*, fastqs_size_bytes, num_threads, star_index_size_bytes, sorted_bam, exons_only=False):
+    # Peak RAM across the barcoding, STAR and molecule info stages, sharing the baseline estimate between them.
+    baseline_ram_bytes = baseline_ram_estimator(fastqs_size_gb=fastqs_size_bytes / _GB, num_threads=num_threads)
+    return max(barcoding_ram_estimator(baseline_ram_bytes=baseline_ram_bytes, num_threads=num_threads),
+               star_ram_estimator(star_index_size_bytes=star_index_size_bytes, num_threads=num_threads,
+                                  baseline_ram_bytes=baseline_ram_bytes, sorted_bam=sorted_bam),
+               molinfo_ram_estimator(baseline_ram_bytes=baseline_ram_bytes, fastqs_size_bytes=fastqs_size_bytes,
+                                     num_threads=num_threads, exons_only=exons_only))
+
+
+# Previous directory sizes, keyed by (path_key, recursive). Sized by both the thread and resource estimators
+#   in cells mode.
+_previous_dir_size_cache = {}
+
+
+def get_previous_dir_size(*, previous_directory: LatchDir, recursive: bool = True) -> int:
+    """
+    Size of the previous run's output directory in bytes; callers convert to GB where needed.
+
+    Params:
+        recursive: Include nested directories (BAMs, matrices, etc.), as needed for the disk estimate.
+            Otherwise only files at the top level are counted, which is what the cells-mode RAM and thread
+            estimates were calibrated on.
+    """
+    cache_key = (path_key(previous_directory), recursive)
+    if cache_key not in _previous_dir_size_cache:
+        previous_dir_size = None
+        if recursive and previous_directory.remote_path is not None:
+            # One subtree-size query on Latch instead of a size() lookup per file.
+            previous_dir_size = previous_directory.size_recursive()
+        if previous_dir_size is None:
+            previous_dir_size = sum_latch_file_sizes(
+                [file for file in previous_directory.iterdir() if isinstance(file, LatchFile)])
+        _previous_dir_size_cache[cache_key] = previous_dir_size
+    return _previous_dir_size_cache[cache_key]
+
+
+def clear_cache():
+    # Forget all memoized sizes, e.g. between tests or after inputs changed in place.
+    for cache in (_s3_object_size_cache, _fastqs_size_cache, _mapping_ref_size_cache, _previous_dir_size_cache):
+        cache.clear()
+
+
+# Thread tiers by input size: < 1 GB -> 8, < 4 GB -> 16, < 8 GB -> 32, < 16 GB -> 48, otherwise 64.
+_THREAD_TIER_THRESHOLDS_GB = (1, 4, 8, 16)
+_THREAD_TIERS = (8, 16, 32, 48, 64)
+
+
+def _threads_for_size(size_gb):
+    return _THREAD_TIERS[bisect.bisect_right(_THREAD_TIER_THRESHOLDS_GB, size_gb)]
 
 
 def get_num_threads(pipseeker_mode: str = None,
                     fastq_directory: Optional[LatchDir] = None,
                     previous: Optional[LatchDir] = None,
                     override_cpu: Optional[int] = None,
+                    fastqs_size_bytes: Optional[int] = None,
+                    input_bytes: Optional[int] = None,
+                    input_reads: Optional[int] = None,
+                    estimate_size_from_reads: bool = False,
                     **kwargs) -> int:
     """
     Set number of cores based on a balance between cost savings and speed.
     For 'full' mode, set based on the size of input fastqs.
     For 'cells' mode, set based on the size of the previous directory.
     For 'buildmapref' mode, set to 32 cores to tap into the max efficiency of STAR.
+
+    Params:
+        fastqs_size_bytes: Already computed (not downsampled) size of fastq_directory, so it is not sized again.
+        input_bytes, estimate_size_from_reads: See get_memory_requirement_gb.
     """
 
     # Check for override.
@@ -186,34 +358,15 @@ def get_num_threads(pipseeker_mode: str = None,
 
     if pipseeker_mode == PIPseekerMode.full.value:
 
-        fastqs_size_bytes = get_fastqs_size_bytes(fastq_directory=fastq_directory, downsample_factor=None)
-        fastqs_size_gb = fastqs_size_bytes / 1024 ** 3
-
-        if fastqs_size_gb < 1:
-            num_threads = 8
-        elif fastqs_size_gb < 4:
-            num_threads = 16
-        elif fastqs_size_gb < 8:
-            num_threads = 32
-        elif fastqs_size_gb < 16:
-            num_threads = 48
-        else:
-            num_threads = 64
+        if fastqs_size_bytes is None:
+            fastqs_size_bytes = get_fastqs_size_bytes(fastq_directory=fastq_directory, downsample_factor=None,
+                                                      input_bytes=input_bytes, input_reads=input_reads,
+                                                      estimate_from_reads=estimate_size_from_reads)
+        num_threads = _threads_for_size(fastqs_size_bytes / _GB)
 
     elif pipseeker_mode == PIPseekerMode.cells.value:
-        previous_dir_size_bytes = get_previous_dir_size(previous_directory=previous)
-        previous_dir_size_gb = previous_dir_size_bytes / 1024 ** 3
-
-        if previous_dir_size_gb < 1:
-            num_threads = 8
-        elif previous_dir_size_gb < 4:
-            num_threads = 16
-        elif previous_dir_size_gb < 8:
-            num_threads = 32
-        elif previous_dir_size_gb < 16:
-            num_threads = 48
-        else:
-            num_threads = 64
+        previous_dir_size_bytes = get_previous_dir_size(previous_directory=previous, recursive=False)
+        num_threads = _threads_for_size(previous_dir_size_bytes / _GB)
 
     else:
         # buildmapref_mode
@@ -236,6 +389,8 @@ def get_disk_requirement_gb(*, pipseeker_mode: str = None,
                             custom_prebuilt_genome_zipped: Optional[LatchFile],
                             safety_margin=2,  # include 50% overage since have unexpected overhead.
                             override_disk_gb: Optional[int] = None,
+                            input_bytes: Optional[int] = None,
+                            estimate_size_from_reads: bool = False,
                             **kwargs
                             ) -> int:
     """
@@ -243,6 +398,10 @@ def get_disk_requirement_gb(*, pipseeker_mode: str = None,
     For 'cells' mode, use the size of the previous directory * 1.5 (or updated safety margin) to estimate disk space.
                     --> uses a min of 2GB if the above is less than this value
     For 'buildmapref' mode, set to 100 GB as a default.
+
+    Params:
+        input_bytes: Known total size of the input fastqs, used instead of listing fastq_directory.
+        estimate_size_from_reads: Estimate the input fastqs size from input_reads instead of listing fastq_directory.
     """
 
     # Check for override.
@@ -253,14 +412,23 @@ def get_disk_requirement_gb(*, pipseeker_mode: str = None,
         raise ValueError('pipseeker_mode must be specified.')
 
     if pipseeker_mode == PIPseekerMode.full.value:
+        # With no inputs and no reference there is nothing to size, so skip straight to the minimum disk
+        #   without any Latch/S3 lookups.
+        has_input_size = input_bytes is not None or (estimate_size_from_reads and bool(input_reads))
+        if not any((fastq_directory, snt_fastq, hto_fastq, has_input_size)) and \
+                genome_source not in ('prebuilt_genome', 'custom_prebuilt_genome'):
+            return 4
+
         # Set defaults.
         fastqs_size_bytes = 0
         snt_fastq_size_bytes = 0
         hto_fastq_size_bytes = 0
 
-        if fastq_directory:
+        if fastq_directory or has_input_size:
             downsample_factor = get_downsample_factor(downsample_to=downsample_to, input_reads=input_reads)
-            fastqs_size_bytes = get_fastqs_size_bytes(fastq_directory=fastq_directory, downsample_factor=downsample_factor)
+            fastqs_size_bytes = get_fastqs_size_bytes(fastq_directory=fastq_directory, downsample_factor=downsample_factor,
+                                                      input_bytes=input_bytes, input_reads=input_reads,
+                                                      estimate_from_reads=estimate_size_from_reads)
 
         if snt_fastq:
             snt_fastq_size_bytes = get_fastqs_size_bytes(fastq_directory=snt_fastq, downsample_factor=None)
@@ -285,7 +453,7 @@ def get_disk_requirement_gb(*, pipseeker_mode: str = None,
             star_index_size_bytes = star_index_size_bytes * 2.25
 
         # Final calculation
-        required_space_gb = (fastqs_size_bytes + star_index_size_bytes + 1 ) * safety_margin / 1024 ** 3
+        required_space_gb = (fastqs_size_bytes + star_index_size_bytes + 1 ) * safety_margin / _GB
         required_space_gb = int(required_space_gb) + 1  # Round up
         # In event have < 1GB, will be rounded to 0. Setting minimum default disk as 2GB.
         return max(required_space_gb, 4)
@@ -294,7 +462,7 @@ def get_disk_requirement_gb(*, pipseeker_mode: str = None,
         # Get the size of the previous directory and multiply by safety margin
         #  to include chance of adding additional sensitivity levels, etc.
         previous_dir_size_bytes = get_previous_dir_size(previous_directory=previous)
-        required_space_gb = previous_dir_size_bytes * safety_margin / 1024 ** 3
+        required_space_gb = previous_dir_size_bytes * safety_margin / _GB
         required_space_gb = int(required_space_gb) + 1  # Round up
         return max(required_space_gb, 10)
 
@@ -317,6 +485,8 @@ def get_memory_requirement_gb(*,
                               sorted_bam: bool = False,
                               minimum_ram_latch = 10,
                               override_ram_gb: Optional[int] = None,
+                              input_bytes: Optional[int] = None,
+                              estimate_size_from_reads: bool = False,
                               **kwargs) -> int:
     """
     For 'full' mode, use standard peak barcoding, STAR, and molecule info RAM estimators.
@@ -331,6 +501,8 @@ def get_memory_requirement_gb(*,
         custom_prebuilt_genome_zipped: Custom prebuilt genome zipped file (if applicable). None if other genome was used or cells mode.
         previous: The previous directory (only used for 'cells' mode).
         minimum_ram: Minimum RAM required for latch deployment (due to higher baseline requirement than expected).
+        input_bytes: Known total size of the input fastqs, used instead of listing fastq_directory.
+        estimate_size_from_reads: Estimate the input fastqs size from input_reads instead of listing fastq_directory.
     """
     # Check for override.
     if override_ram_gb:
@@ -342,32 +514,39 @@ def get_memory_requirement_gb(*,
     if pipseeker_mode == PIPseekerMode.full.value:
         # Get fastq size.
         downsample_factor = get_downsample_factor(downsample_to=downsample_to, input_reads=input_reads)
-        fastqs_size_bytes = get_fastqs_size_bytes(fastq_directory=fastq_directory, downsample_factor=downsample_factor)
-        fastqs_size_gb = fastqs_size_bytes / 1024 ** 3
+        size_kwargs = dict(fastq_directory=fastq_directory, input_bytes=input_bytes, input_reads=input_reads,
+                           estimate_from_reads=estimate_size_from_reads)
+        fastqs_size_bytes = get_fastqs_size_bytes(downsample_factor=downsample_factor, **size_kwargs)
 
         # Num threads calc.
-        num_threads = get_num_threads(fastq_directory=fastq_directory, pipseeker_mode=pipseeker_mode)
-
-        # Baseline ram calc.
-        baseline_ram_bytes = baseline_ram_estimator(fastqs_size_gb=fastqs_size_gb, num_threads=num_threads)
-        barcoding_ram_bytes = barcoding_ram_estimator(baseline_ram_bytes=baseline_ram_bytes, num_threads=num_threads)
-        star_index_size_bytes = mapping_ref_size_estimator(genome_source=genome_source, prebuilt_genome=prebuilt_genome,
-                                                           custom_prebuilt_genome=custom_prebuilt_genome,
-                                                           custom_prebuilt_genome_zipped=custom_prebuilt_genome_zipped)
-        star_ram_bytes = star_ram_estimator(star_index_size_bytes=star_index_size_bytes, num_threads=num_threads,
-                                            baseline_ram_bytes=baseline_ram_bytes, sorted_bam=sorted_bam)
-        molinfo_ram_bytes = molinfo_ram_estimator(baseline_ram_bytes=baseline_ram_bytes,
-                                                  fastqs_size_bytes=fastqs_size_bytes,
-                                                  num_threads=num_threads)
-        required_ram = minimum_ram_latch + int( max(barcoding_ram_bytes, star_ram_bytes, molinfo_ram_bytes) / 1024 ** 3) + 1  # Round up
+        raw_fastqs_size_bytes = _get_input_fastqs_size_bytes(**size_kwargs)
+        num_threads = get_num_threads(fastq_directory=fastq_directory, pipseeker_mode=pipseeker_mode,
+                                      fastqs_size_bytes=raw_fastqs_size_bytes)
+
+        ram_kwargs = dict(fastqs_size_bytes=fastqs_size_bytes, num_threads=num_threads, sorted_bam=sorted_bam)
+        max_ram_bytes = None
+        if genome_source == 'prebuilt_genome':
+            # Prebuilt indices are bounded in size. If the peak is the same for an empty and the largest
+            #   prebuilt index, STAR is never the peak and the reference size lookup can be skipped.
+            max_ram_bytes = _compute_max_ram_bytes(star_index_size_bytes=0, **ram_kwargs)
+            if _compute_max_ram_bytes(star_index_size_bytes=_MAX_PREBUILT_INDEX_BYTES, **ram_kwargs) != max_ram_bytes:
+                max_ram_bytes = None
+        if max_ram_bytes is None:
+            star_index_size_bytes = mapping_ref_size_estimator(genome_source=genome_source,
+                                                               prebuilt_genome=prebuilt_genome,
+                                                               custom_prebuilt_genome=custom_prebuilt_genome,
+                                                               custom_prebuilt_genome_zipped=custom_prebuilt_genome_zipped)
+            max_ram_bytes = _compute_max_ram_bytes(star_index_size_bytes=star_index_size_bytes, **ram_kwargs)
+        required_ram = minimum_ram_latch + int(max_ram_bytes / _GB) + 1  # Round up
         return max(required_ram, minimum_ram_latch)
 
     elif pipseeker_mode == PIPseekerMode.cells.value:
         # Num threads calc should technically be incorporated here but has never been measured.
 
-        # Get previous dir size.
-        previous_dir_size_bytes = get_previous_dir_size(previous_directory=previous)
-        previous_dir_size_gb = int(previous_dir_size_bytes / 1024 ** 3) + 1  # Round up
+        # Get previous dir size. Top-level files only: the formula below was calibrated on them, and the nested
+        #   BAMs (often many GB) are not what drives cells-mode RAM.
+        previous_dir_size_bytes = get_previous_dir_size(previous_directory=previous, recursive=False)
+        previous_dir_size_gb = int(previous_dir_size_bytes / _GB) + 1  # Round up
 
         # Add on latch baseline RAM requirement.
         required_ram = previous_dir_size_gb * 3 + minimum_ram_latch